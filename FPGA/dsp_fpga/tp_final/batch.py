@@ -0,0 +1,237 @@
+import os
+import sys
+import glob
+import argparse
+
+from dsp_fpga.tp_final.core import FILTERS, Pool, find_filter, quantize, normalize
+from dsp_fpga.tp_final.protocol import PACK_PIXELS, PACK_RESPONSES, BASE_BAUDRATE
+
+import numpy as np
+from matplotlib.image import imread, imsave
+
+from collections import deque
+from time import perf_counter
+
+EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+def parse_params(params):
+    res = {}
+    for param in params:
+        name, sep, value = param.partition('=')
+        if not sep:
+            raise ValueError("Invalid parameter: {} is not name=value".format(param))
+        res[name.strip()] = value.strip()
+
+    return res
+
+def iter_images(inputs):
+    # Directories are taken whole, anything else as a glob pattern
+    seen = set()
+    for entry in inputs:
+        if os.path.isdir(entry):
+            paths = sorted(
+                os.path.join(entry, name) for name in os.listdir(entry)
+                if name.lower().endswith(EXTENSIONS)
+            )
+        else:
+            paths = sorted(glob.glob(entry))
+
+        for path in paths:
+            if path not in seen and os.path.isfile(path):
+                seen.add(path)
+                yield path
+
+def output_paths(paths, out, suffix):
+    # Images keep their place below the directory all of them are in, so the
+    # same name in different directories does not collide
+    if not paths:
+        return {}
+
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    return {
+        path: os.path.join(out, os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0] + suffix + '.png')
+        for path in paths
+    }
+
+def hw_apply(session, filter, img):
+    # Same steps as Gui.apply_filter
+    if len(img.shape) == 2:
+        img = img.reshape(*img.shape, 1)
+
+    img    = quantize(img)
+    kernel = filter.get_hw_kernel()
+    shift, output = filter.get_hw_scale()
+
+    if not session.fits(img, kernel):
+        return filter.apply(img)
+
+    res = session.run(img, kernel, border = filter.get_border(), shift = shift, output = output)
+    if res is None:
+        return None
+
+    if res.shape[2] == 1:
+        res = res.reshape(res.shape[:2])
+
+    return normalize(res)
+
+def save(path, res):
+    from PIL import Image
+
+    if isinstance(res, Image.Image):
+        res = np.asarray(res.convert('RGBA' if 'A' in res.getbands() else 'RGB'))
+
+    res = np.asarray(res)
+    if len(res.shape) == 3 and res.shape[2] == 1:
+        res = res.reshape(res.shape[:2])
+
+    imsave(path, res, cmap = 'gray' if len(res.shape) < 3 else None)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filter', nargs = '?')
+    parser.add_argument('inputs', nargs = '*')
+    parser.add_argument('--out', required = False, default = 'filtered')
+    parser.add_argument('--param', required = False, action = 'append', default = [])
+    parser.add_argument('--suffix', required = False, default = '')
+    parser.add_argument('--list', required = False, action = 'store_true', default = False)
+    parser.add_argument('--port', required = False, default = '/dev/ttyUSB0')
+    parser.add_argument('--baudrate', required = False, type = int, default = 2000000)
+    parser.add_argument('--base-baudrate', required = False, type = int, default = BASE_BAUDRATE)
+    parser.add_argument('--pack', required = False, action = 'store_true', default = False)
+    parser.add_argument('--jobs', required = False, type = int, default = 1)
+    parser.add_argument('--software', required = False, action = 'store_true', default = False)
+    args = parser.parse_intermixed_args()
+
+    if args.list:
+        for cls in FILTERS:
+            params = ' '.join('{}={:g}'.format(k, v) for k, v in cls.PARAMS.items() if k not in cls.CHOICES)
+            params = ' '.join([params] + ['{}={}'.format(k, '|'.join(v)) for k, v in cls.CHOICES.items()])
+            print('{:20} {:22} {}'.format(cls.__name__, cls.NAME, params.strip() or '-'))
+        sys.exit(0)
+
+    if args.filter is None or not args.inputs:
+        parser.error("a filter and at least one input are required")
+
+    cls = find_filter(args.filter)
+    if cls is None:
+        print("Unknown filter: {}".format(args.filter))
+        sys.exit(1)
+
+    try:
+        filter = cls(**parse_params(args.param))
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    if filter.hw and not filter.valid_size():
+        print("Invalid kernel size: {:g}, odd sizes up to {} only".format(filter.params['size'], filter.MAX_KERNEL_SIZE))
+        sys.exit(1)
+
+    # HW filters run in software when asked to, or when the FPGA is missing,
+    # with the same results
+    session = None
+    if filter.hw and not args.software:
+        from dsp_fpga.tp_final.session import Session
+
+        session = Session(
+            args.port, args.baudrate, 10,
+            packing       = PACK_PIXELS | PACK_RESPONSES if args.pack else 0,
+            base_baudrate = args.base_baudrate,
+        )
+        if not session.healthy():
+            print("Running {} in software".format(filter.name))
+            session.close()
+            session = None
+
+    # There is a single FPGA, HW filters on it always go one image at a time
+    pool = None
+    if args.jobs > 1 and session is None:
+        pool = Pool(args.jobs)
+
+    paths = list(iter_images(args.inputs))
+    dests = output_paths(paths, args.out, args.suffix)
+
+    # Only the extension is left to tell some images apart
+    if len(set(dests.values())) < len(dests):
+        taken = {}
+        for path, dest in dests.items():
+            if dest in taken:
+                print("{} and {} would both be written to {}".format(taken[dest], path, dest))
+            taken.setdefault(dest, path)
+        sys.exit(1)
+
+    os.makedirs(args.out, exist_ok = True)
+
+    count  = 0
+    failed = 0
+    start  = perf_counter()
+    read   = deque()
+
+    def images():
+        global failed
+        for path in paths:
+            try:
+                t0  = perf_counter()
+                img = imread(path)
+            except Exception as e:
+                failed += 1
+                print('{}: failed, {}'.format(path, e))
+                continue
+
+            read.append((path, img.shape, perf_counter() - t0))
+            yield img
+
+    def results():
+        if pool is not None and len(paths) > 1:
+            yield from pool.imap(filter, images())
+            return
+
+        if pool is not None:
+            # A lone image is split by channels instead
+            for img in images():
+                t0  = perf_counter()
+                res = pool.apply(filter, img)
+                yield res, perf_counter() - t0
+            return
+
+        for img in images():
+            t0  = perf_counter()
+            res = hw_apply(session, filter, img) if session is not None else filter.apply(img)
+            yield res, perf_counter() - t0
+
+    # Every image is written out as soon as it is filtered, so nothing is
+    # kept beyond the ones in progress
+    try:
+        for res, took in results():
+            path, shape, tread = read.popleft()
+            dest = dests[path]
+
+            try:
+                if res is None:
+                    raise ValueError("result got lost")
+
+                os.makedirs(os.path.dirname(dest), exist_ok = True)
+                t0 = perf_counter()
+                save(dest, res)
+                twrite = perf_counter() - t0
+
+            except Exception as e:
+                failed += 1
+                print('{}: failed, {}'.format(path, e))
+                continue
+
+            count += 1
+            print('{}: {}x{} filtered in {:.3f}s (read {:.3f}s, write {:.3f}s) -> {}'.format(
+                path, shape[0], shape[1], took, tread, twrite, dest,
+            ))
+
+    finally:
+        if session is not None:
+            session.close()
+        if pool is not None:
+            print(pool.report())
+            pool.close()
+
+    took = perf_counter() - start
+    print('{} image(s) in {:.2f}s, {} failed'.format(count, took, failed))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,3 @@
+from dsp_fpga.tp_final.core.filters import *
+from dsp_fpga.tp_final.core.levels import quantize, normalize, varying
+from dsp_fpga.tp_final.core.pool import Pool
@@ -0,0 +1,648 @@
+import numpy as np
+import weakref
+
+from dsp_fpga.tp_final.core.levels import quantize, normalize, varying
+from dsp_fpga.tp_final.core.radon import radon, iradon
+from dsp_fpga.tp_final.core.kernels import convolve
+from dsp_fpga.tp_final.protocol import (
+    separate, fit_shift, BORDER_ZERO, BORDER_REPLICATE, BORDER_MIRROR, OUTPUT_WRAP24, OUTPUT_SAT16, OUTPUT_SAT8, OUTPUT_UINT8,
+)
+
+# Only numpy is imported up front, cv2, PIL and skimage are imported by the
+# filters that use them, when applied
+
+BORDERS = {
+    'Zero'      : BORDER_ZERO,
+    'Replicate' : BORDER_REPLICATE,
+    'Mirror'    : BORDER_MIRROR,
+}
+
+OUTPUTS = {
+    '24 bits'   : OUTPUT_WRAP24,
+    '16 bits'   : OUTPUT_SAT16,
+    '8 bits'    : OUTPUT_SAT8,
+}
+
+class Filter:
+
+    # Name shown in the GUI, and every parameter with its default value
+    NAME    = None
+    PARAMS  = {}
+    # Parameters taking one of a set of named values
+    CHOICES = {}
+    # Filters working on one channel at a time set CHANNELWISE and implement
+    # get_output and apply_channel instead of apply. Every channel is then
+    # written into one buffer of planes, with the alpha channel dropped and
+    # constant channels left at 0.
+    CHANNELWISE = False
+
+    def __init__(self, **params):
+        self.name   = self.NAME
+        self.hw     = False
+        self.params = dict(self.PARAMS)
+        self.configure(**params)
+
+    def configure(self, **params):
+        for param, value in params.items():
+            if param not in self.PARAMS:
+                raise ValueError("Invalid parameter for {}: {}".format(self.name, param))
+
+            if param in self.CHOICES:
+                choices = {name.lower(): v for name, v in self.CHOICES[param].items()}
+                if isinstance(value, str) and value.lower() in choices:
+                    value = choices[value.lower()]
+                elif value not in choices.values():
+                    raise ValueError("Invalid value for {}: {}".format(param, value))
+            else:
+                value = float(value)
+
+            self.params[param] = value
+
+        return self
+
+    def apply(self, img):
+        if not self.CHANNELWISE:
+            return img
+
+        try:
+            colors, keep = self.split(img)
+            if not len(keep):
+                return img
+
+            planes = self.get_planes(colors)
+            self.apply_channels(colors, keep, planes)
+            return self.merge(planes)
+
+        except Exception as e:
+            print(e)
+            return img
+
+    def split(self, img):
+        if len(img.shape) not in [2, 3]:
+            print("Invalid image shape")
+            return img, []
+
+        if len(img.shape) == 2:
+            img = img.reshape(*img.shape, 1)
+
+        img  = img[:, :, :3]
+        keep = varying(img)
+        if not keep.size:
+            print("Invalid image: all channels are constant")
+
+        return img, keep
+
+    def get_planes(self, img):
+        shape, dtype = self.get_output(img.shape[:2])
+        return np.zeros((img.shape[2], *shape), dtype = dtype)
+
+    def get_output(self, shape):
+        # Shape and type of the result for a channel of the given shape
+        return shape, np.uint8
+
+    def apply_channels(self, img, keep, planes):
+        for dim in keep:
+            self.apply_channel(img[:, :, dim], planes[dim])
+
+    def apply_channel(self, chan, out):
+        out[...] = chan
+
+    def merge(self, planes):
+        res = np.moveaxis(planes, 0, -1)
+        if res.shape[2] == 1:
+            res = res[:, :, 0]
+
+        return normalize(res)
+
+class Identity(Filter):
+    NAME = 'Identity'
+
+class HWFilter(Filter):
+    MAX_KERNEL_SIZE = 11
+    PARAMS          = {
+        'size'      : 1.,
+        'border'    : BORDER_ZERO,
+        'output'    : OUTPUT_WRAP24,
+    }
+    CHOICES         = {
+        'border'    : BORDERS,
+        'output'    : OUTPUTS,
+    }
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.hw = True
+
+    def get_kernel(self):
+        return np.array([1])
+
+    def get_border(self):
+        return self.params['border']
+
+    def valid_size(self):
+        # KernelFilter only takes odd sizes up to the one it was built for
+        size = self.params['size']
+        return size == int(size) and size % 2 == 1 and 0 < size <= self.MAX_KERNEL_SIZE
+
+    def get_hw_kernel(self):
+        # Separable kernels are sent as a column and a row, which is both a
+        # smaller upload and a faster filter
+        kernel = self.get_kernel()
+        factors = separate(kernel)
+        return kernel if factors is None else factors
+
+    def get_hw_scale(self):
+        # Fewer bits come back scaled down to fit, which the result is
+        # normalized to anyway, unsigned if the kernel has no negative taps
+        kernel = np.asarray(self.get_kernel(), dtype = np.int64)
+        output = self.params['output']
+        if output == OUTPUT_SAT8 and kernel.min() >= 0:
+            output = OUTPUT_UINT8
+
+        if output == OUTPUT_WRAP24:
+            return 0, output
+
+        return fit_shift(kernel, output), output
+
+    def apply(self, img):
+        # Software stand-in for the FPGA, same steps as Gui.apply_filter and
+        # the same responses
+        if len(img.shape) not in [2, 3]:
+            print("Invalid image shape")
+            return img
+
+        if not self.valid_size():
+            print("Invalid kernel size: {:g}".format(self.params['size']))
+            return img
+
+        if len(img.shape) == 2:
+            img = img.reshape(*img.shape, 1)
+
+        shift, output = self.get_hw_scale()
+        res = convolve(quantize(img), self.get_hw_kernel(), self.get_border(), shift, output)
+
+        if res.shape[2] == 1:
+            res = res.reshape(res.shape[:2])
+
+        return normalize(res)
+
+class GaussianBlur(HWFilter):
+    NAME   = 'Gaussian blur'
+    PARAMS = {**HWFilter.PARAMS, 'sigma': 1.}
+
+    @staticmethod
+    def gaussian_filter(k, sigma):
+        def get_axis(x, y):
+            return np.repeat([np.arange(x)], y, axis = 0).astype(float)
+
+        x = get_axis(k, k)
+        center = (k - 1)//2
+        D = ((x.T - center)**2 + (x - center)**2)
+        return 1/(2 * np.pi * sigma**2) * np.exp(-D/(2 * sigma**2))
+
+    def get_kernel(self):
+        k = self.gaussian_filter(int(self.params['size']), self.params['sigma'])
+        return (k / abs(k.min())).round().astype(np.uint8)
+
+class BoxBlur(HWFilter):
+    NAME = 'Box blur'
+
+    def get_kernel(self):
+        k = int(self.params['size'])
+        return np.ones((k, k), dtype = np.uint8)
+
+class RidgeDetection(HWFilter):
+    NAME   = 'Ridge Detection'
+    PARAMS = {**HWFilter.PARAMS, 'center': 0.}
+
+    def get_kernel(self):
+        k = int(self.params['size'])
+        res = np.full((k, k), -1)
+        res[k//2, k//2] = int(self.params['center'])
+        return res
+
+class Sharpen(HWFilter):
+    NAME   = 'Sharpen'
+    PARAMS = {**HWFilter.PARAMS, 'center': 0.}
+
+    def get_kernel(self):
+        k = int(self.params['size'])
+
+        res = np.full((k, k), -1)
+        res[0, 0] = res[k-1, 0] = res[0, k-1] = res[k-1, k-1] = 0
+        res[k//2, k//2] = int(self.params['center'])
+        return res
+
+class MotionBlur(HWFilter):
+    NAME = 'Motion blur'
+
+    def get_kernel(self):
+        size = int(self.params['size'])
+
+        kernel = np.zeros((size, size), dtype = np.uint16)
+        kernel[size//2, : ] = np.ones(size)
+
+        return kernel
+
+class Negative(Filter):
+    NAME = 'Negative'
+
+    def apply(self, img):
+        if len(img.shape) not in [2, 3]:
+            print("Invalid image shape")
+            return img
+
+        norm = quantize(img)
+        if len(img.shape) == 3 and img.shape[2] > 3:
+            norm = norm[:, :, :-1]
+
+        return np.subtract(255, norm, dtype = np.uint8)
+
+class SaltnPepper(Filter):
+    NAME   = 'Salt and pepper'
+    PARAMS = {
+        'density'   : 0.,
+        'seed'      : -1.,
+    }
+
+    # Bounds of the share of pixels turned white, and black, when no density
+    # is given
+    MIN_CHANGE = 0.05
+    MAX_CHANGE = 0.25
+
+    def apply(self, img):
+        if len(img.shape) not in [2, 3]:
+            print("Invalid image shape")
+            return img
+
+        if len(img.shape) == 2:
+            img = img.reshape(*img.shape, 1)
+
+        # A negative seed takes a fresh one every time
+        seed    = int(self.params['seed'])
+        rng     = np.random.default_rng(None if seed < 0 else seed)
+        density = self.params['density'] or rng.uniform(2 * self.MIN_CHANGE, 2 * self.MAX_CHANGE)
+
+        # Constant channels are left out and the alpha channel left as is,
+        # the same pixels are hit in every other channel
+        keep = varying(img)
+        src  = img if len(keep) == img.shape[2] else img[:, :, keep]
+
+        res    = quantize(src, per_channel = True, out = np.empty(src.shape, dtype = np.uint8))
+        colors = res[:, :, : np.count_nonzero(keep < 3)]
+
+        noise = rng.random(img.shape[:2])
+        colors[noise < density / 2] = 255
+        colors[(noise >= density / 2) & (noise < density)] = 0
+
+        if res.shape[2] == 1:
+            res = res.reshape(*res.shape[:2])
+
+        return normalize(res)
+
+class Median(Filter):
+    NAME   = 'Median'
+    PARAMS = {'size': 1.}
+
+    def apply(self, img):
+        import cv2
+
+        try:
+            return cv2.medianBlur(img, int(self.params['size']))
+        except Exception as e:
+            print(e)
+            return img
+
+class Histogram(Filter):
+    NAME        = 'Histogram'
+    CHANNELWISE = True
+
+    def get_output(self, shape):
+        # The original and the equalized channel side by side
+        return (shape[0], 2 * shape[1]), np.uint8
+
+    def apply_channel(self, chan, out):
+        import cv2
+
+        chan = np.ascontiguousarray(quantize(chan))
+        out[:, : chan.shape[1]] = chan
+        out[:, chan.shape[1] :] = cv2.equalizeHist(chan)
+
+class ImAdjust(Filter):
+    NAME   = 'ImAdjust'
+    PARAMS = {
+        'vin_min'   : 0.,
+        'vin_max'   : 1.,
+        'vout_min'  : 0.,
+        'vout_max'  : 1.,
+        'tol'       : 0.,
+    }
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.cache = None
+
+    def __getstate__(self):
+        # The cache stays behind when sent to another process
+        return {**self.__dict__, 'cache': None}
+
+    def prepare(self, img):
+        # The normalized channels and their cumulative histograms only depend
+        # on the image, they are kept while the same image is being adjusted
+        if self.cache is not None and self.cache[0]() is img:
+            return self.cache[1:]
+
+        src  = img.reshape(*img.shape, 1) if len(img.shape) == 2 else img
+        keep = varying(src)
+        src  = quantize(src if len(keep) == src.shape[2] else src[:, :, keep], per_channel = True)
+
+        chans = []
+        cums  = []
+        for dim in range(len(keep)):
+            _img = src[:, :, dim]
+
+            # Same bins as np.histogram over range(256), 255 shares the last one
+            count = np.bincount(_img.ravel(), minlength = 256)
+            hist  = count[:255]
+            hist[-1] += count[255]
+
+            chans.append(_img)
+            cums.append(np.cumsum(hist))
+
+        self.cache = (weakref.ref(img), chans, cums)
+        return chans, cums
+
+    def get_lut(self, cum, total):
+        vin  = [int(self.params['vin_min']), int(self.params['vin_max'])]
+        vout = [int(self.params['vout_min']), int(self.params['vout_max'])]
+        tol  = max(0, min(100, int(self.params['tol'])))
+
+        if tol > 0:
+            vin[0] = np.searchsorted(cum, total * tol / 100)
+            vin[1] = np.searchsorted(cum, total * (100 - tol) / 100)
+
+        if vin[0] == vin[1]:
+            return None
+
+        # Stretching, every level below vin min goes to vout min
+        scale = (vout[1] - vout[0]) / (vin[1] - vin[0])
+        lut   = np.maximum(np.arange(256) - vin[0], 0) * scale + .5 + vout[0]
+        return np.clip(lut, 0, min(vout[1], 255)).astype(np.uint8)
+
+    def apply(self, img):
+        if len(img.shape) not in [2, 3]:
+            print("Invalid image shape")
+            return img
+
+        chans, cums = self.prepare(img)
+        if not chans:
+            print("Constant image, nothing to adjust")
+            return img
+
+        res = np.empty((*chans[0].shape, len(chans)), dtype = np.uint8)
+        for dim, (_img, cum) in enumerate(zip(chans, cums)):
+            lut = self.get_lut(cum, _img.size)
+            if lut is None:
+                print("Invalid input range, vin min and max must differ")
+                return img
+
+            np.take(lut, _img, out = res[:, :, dim])
+
+        if res.shape[2] == 1:
+            res = res.reshape(*res.shape[:2])
+
+        return normalize(res)
+
+class BitPlaneSlicing(Filter):
+    NAME = 'Bit plane slicing'
+
+    # Planes from the most significant one, laid out in 2 rows of 4
+    MASKS = (1 << np.arange(7, -1, -1)).astype(np.uint8)
+
+    def apply(self, img):
+        try:
+            if len(img.shape) not in [2, 3]:
+                print("Invalid image shape")
+                return img
+
+            if len(img.shape) == 2:
+                img = img.reshape(*img.shape, 1)
+
+            # Constant channels are left out. Images of bytes are sliced as
+            # they are, anything else is first stretched to 0..255.
+            keep = varying(img)
+            if not keep.size:
+                print("Invalid image: all channels are constant")
+                return img
+
+            _img = img if len(keep) == img.shape[2] else img[:, :, keep]
+            if _img.dtype != np.uint8:
+                _img = quantize(_img, per_channel = True)
+
+            h, w, c = _img.shape
+            planes  = _img[None] & self.MASKS[:, None, None, None]
+            res     = planes.reshape(2, 4, h, w, c).transpose(0, 2, 1, 3, 4).reshape(2 * h, 4 * w, c)
+
+            if res.shape[2] == 1:
+                res = res.reshape(*res.shape[:2])
+            return normalize(res)
+
+        except Exception as e:
+            print(e)
+            return img
+
+class BrightnessEnhancer(Filter):
+    NAME   = 'Brightness Enhancer'
+    PARAMS = {'factor': 0.}
+
+    def apply(self, img):
+        from PIL import Image, ImageEnhance
+
+        try:
+            if len(img.shape) not in [2, 3]:
+                print("Invalid image shape")
+                return img
+
+            if len(img.shape) == 2:
+                res = img.reshape(*img.shape, 1)
+
+            else:
+                res = img
+
+            res = quantize(res)
+            return ImageEnhance.Brightness(Image.fromarray(res)).enhance(self.params['factor'])
+
+        except Exception as e:
+            print(e)
+            return img
+
+class ColorLimitation(Filter):
+    NAME   = 'Color Limitation'
+    PARAMS = {'ncolors': 1.}
+
+    def apply(self, img):
+        from PIL import Image
+
+        try:
+            if len(img.shape) not in [2, 3]:
+                print("Invalid image shape")
+                return img
+
+            if len(img.shape) == 2:
+                res = img.reshape(*img.shape, 1)
+
+            else:
+                res = img
+
+            res = quantize(res)
+
+            return Image.fromarray(res).quantize(int(self.params['ncolors']))
+
+        except Exception as e:
+            print(e)
+            return img
+
+class Downsampler(Filter):
+    NAME        = 'Downsampler'
+    PARAMS      = {'factor': 1.}
+    CHANNELWISE = True
+
+    def get_output(self, shape):
+        # Partial blocks at the edges count as whole ones
+        factor = int(self.params['factor'])
+        return (-(-shape[0] // factor), -(-shape[1] // factor)), np.uint8
+
+    def apply_channel(self, chan, out):
+        from skimage.transform import downscale_local_mean
+
+        factor   = int(self.params['factor'])
+        out[...] = downscale_local_mean(quantize(chan), factors = (factor, factor))
+
+class Logarithmic(Filter):
+    NAME        = 'Logarithmic'
+    CHANNELWISE = True
+
+    def apply_channel(self, chan, out):
+        # Log transformation, scaled back to 0..255
+        chan = normalize(chan, 255)
+        c    = 255 / np.log1p(chan.max())
+
+        np.log1p(chan, out = chan)
+        chan    *= c
+        out[...] = chan
+
+class RadonDirect(Filter):
+    NAME        = 'Radon direct'
+    PARAMS      = {
+        'min_angle' : 0.,
+        'max_angle' : 0.,
+        'sample'    : 1.,
+    }
+    CHANNELWISE = True
+
+    def get_theta(self):
+        return np.linspace(self.params['min_angle'], self.params['max_angle'], int(self.params['sample']))
+
+    def get_output(self, shape):
+        # One projection per angle of the square inscribed in the image
+        return (min(shape), int(self.params['sample'])), np.float32
+
+    def apply_channels(self, img, keep, planes):
+        # Every channel goes through the same projections at once
+        img = np.stack([normalize(img[:, :, dim], 255) for dim in keep], axis = -1)
+        planes[keep] = np.moveaxis(radon(img, self.get_theta()), -1, 0)
+
+    def apply_channel(self, chan, out):
+        out[...] = radon(normalize(chan, 255), self.get_theta())
+
+class RadonInverse(Filter):
+    NAME        = 'Radon inverse'
+    PARAMS      = {
+        'min_angle' : 0.,
+        'max_angle' : 0.,
+    }
+    CHANNELWISE = True
+
+    def get_theta(self, count):
+        # Every column of the image is a projection
+        return np.linspace(self.params['min_angle'], self.params['max_angle'], count)
+
+    def get_output(self, shape):
+        return (shape[0], shape[0]), np.float32
+
+    def apply_channels(self, img, keep, planes):
+        img = np.stack([normalize(img[:, :, dim], 255) for dim in keep], axis = -1)
+        planes[keep] = np.moveaxis(iradon(img, self.get_theta(img.shape[1])), -1, 0)
+
+    def apply_channel(self, chan, out):
+        out[...] = iradon(normalize(chan, 255), self.get_theta(chan.shape[1]))
+
+class MotionBlurSw(Filter):
+    NAME   = 'Motion blur (sw)'
+    PARAMS = {'size': 1.}
+
+    def apply(self, img):
+        import cv2
+
+        size = int(self.params['size'])
+        kernel = np.zeros((size, size))
+        kernel[size//2, :] = 1
+        return normalize(cv2.filter2D(img, -1, kernel))
+
+class Wiener(Filter):
+    NAME   = 'Wiener'
+    PARAMS = {
+        'size'      : 1.,
+        'adjust'    : 0.,
+    }
+
+    def apply(self, img):
+        from skimage import restoration, color
+
+        try:
+            size = int(self.params['size'])
+            balance = self.params['adjust']
+
+            if len(img.shape) >= 3:
+                img = color.rgb2gray(img[:, :, :3])
+
+            kernel = np.zeros((size, size))
+            kernel[size//2, :] = 1
+            res = restoration.wiener(img, psf = kernel, balance = balance)
+
+            return normalize(res)
+
+        except Exception as e:
+            print(e)
+            return img
+
+FILTERS = [
+    Identity,
+    GaussianBlur,
+    Negative,
+    SaltnPepper,
+    Median,
+    Histogram,
+    ImAdjust,
+    BitPlaneSlicing,
+    BrightnessEnhancer,
+    ColorLimitation,
+    Downsampler,
+    Logarithmic,
+    RidgeDetection,
+    Sharpen,
+    BoxBlur,
+    RadonDirect,
+    RadonInverse,
+    MotionBlur,
+    Wiener,
+    MotionBlurSw,
+]
+
+def find_filter(name):
+    # By class name or by the name shown in the GUI, ignoring case
+    for cls in FILTERS:
+        if name.lower() in (cls.__name__.lower(), cls.NAME.lower()):
+            return cls
+
+    return None
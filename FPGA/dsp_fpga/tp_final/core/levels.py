@@ -0,0 +1,71 @@
+import numpy as np
+
+# Images are stretched to bytes for the filters working on levels, and to
+# floats in 0..1 for plotting. Large images are converted a few rows at a
+# time, so no full size temporary is needed besides the result.
+
+# Elements converted at a time
+BLOCK = 1 << 20
+
+def varying(img):
+    # Channels that are not constant, the others have nothing to stretch
+    if len(img.shape) == 2:
+        img = img.reshape(*img.shape, 1)
+
+    return np.flatnonzero(img.min(axis = (0, 1)) != img.max(axis = (0, 1)))
+
+def bounds(img, per_channel):
+    if per_channel and len(img.shape) == 3:
+        return img.min(axis = (0, 1)), img.max(axis = (0, 1))
+
+    return img.min(), img.max()
+
+def quantize(img, per_channel = False, out = None):
+    # Stretched to 0..255 as bytes, each channel on its own if per_channel.
+    # Bytes spanning 0..255 already are given back as they are, unless out
+    # is given. Constant images or channels come out as 0.
+    img = np.asarray(img)
+    low, high = bounds(img, per_channel)
+
+    if img.dtype == np.uint8 and np.all(low == 0) and np.all(high == 255):
+        if out is None:
+            return img
+        out[...] = img
+        return out
+
+    if out is None:
+        out = np.empty(img.shape, dtype = np.uint8)
+
+    span = np.float32(high) - np.float32(low)
+    span = np.where(span > 0, span, 1).astype(np.float32)
+    low  = np.float32(low)
+
+    rows = max(1, BLOCK // max(1, img[0].size))
+    buf  = np.empty((min(rows, len(img)), *img.shape[1:]), dtype = np.float32)
+
+    for start in range(0, len(img), rows):
+        chunk = img[start : start + rows]
+        tmp   = buf[: len(chunk)]
+        np.subtract(chunk, low, out = tmp, dtype = np.float32)
+        tmp *= 255
+        tmp /= span
+        out[start : start + rows] = tmp
+
+    return out
+
+def normalize(img, top = 1., out = None):
+    # Stretched to 0..top as floats, all channels together. Passing the image
+    # itself as out, if it is already float32, does it in place.
+    img = np.asarray(img)
+    low, high = img.min(), img.max()
+
+    if out is None:
+        out = np.empty(img.shape, dtype = np.float32)
+
+    np.subtract(img, low, out = out, dtype = np.float32)
+    if high > low:
+        out *= np.float32(top / (float(high) - float(low)))
+        # Rounding in float32 may take the highest values just past top
+        np.minimum(out, np.float32(top), out = out)
+
+    return out
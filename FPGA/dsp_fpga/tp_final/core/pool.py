@@ -0,0 +1,183 @@
+import numpy as np
+
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from time import perf_counter
+import os
+
+# Images go to the workers and results come back through shared memory,
+# only the names of the blocks and the filters themselves are pickled
+
+def share(arr):
+    shm  = shared_memory.SharedMemory(create = True, size = max(1, arr.nbytes))
+    view = np.ndarray(arr.shape, dtype = arr.dtype, buffer = shm.buf)
+    view[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+def attach(desc):
+    name, shape, dtype = desc
+    shm = shared_memory.SharedMemory(name = name)
+    return shm, np.ndarray(shape, dtype = dtype, buffer = shm.buf)
+
+def drop(desc):
+    shm = shared_memory.SharedMemory(name = desc[0])
+    shm.close()
+    shm.unlink()
+
+def to_array(res):
+    # Some filters give back PIL images
+    if hasattr(res, 'getbands'):
+        res = res.convert('RGBA' if 'A' in res.getbands() else 'RGB')
+
+    return np.ascontiguousarray(res)
+
+def work(filter, desc):
+    shm, img = attach(desc)
+    try:
+        start = perf_counter()
+        res   = to_array(filter.apply(img))
+        took  = perf_counter() - start
+    finally:
+        del img
+        shm.close()
+
+    out, desc = share(res)
+    out.close()
+    return desc, took
+
+def work_channel(filter, desc, dim, out):
+    shm, img = attach(desc)
+    res, planes = attach(out)
+    try:
+        start = perf_counter()
+        filter.apply_channel(img[:, :, dim], planes[dim])
+        return perf_counter() - start
+    finally:
+        del img, planes
+        shm.close()
+        res.close()
+
+class Pool:
+
+    def __init__(self, processes = None, backlog = 2):
+        self.processes = processes or os.cpu_count()
+        self.backlog   = backlog
+        self.executor  = ProcessPoolExecutor(self.processes)
+        self.reset()
+
+    def reset(self):
+        self.stats = {
+            'images'    : 0,
+            'pixels'    : 0,
+            'busy'      : 0.,
+            'start'     : perf_counter(),
+        }
+
+    def imap(self, filter, images):
+        # Results come in the order of the images, each with the seconds the
+        # filter took on it, or None if it failed. At most backlog images per
+        # process are in flight, so images can be read as they are needed.
+        pending = deque()
+        images  = iter(images)
+
+        def submit():
+            for img in images:
+                img = np.ascontiguousarray(img)
+                shm, desc = share(img)
+                pending.append((shm, img.shape, self.executor.submit(work, filter, desc)))
+                return True
+
+            return False
+
+        try:
+            while len(pending) < self.processes * self.backlog and submit():
+                pass
+
+            while pending:
+                shm, shape, future = pending.popleft()
+                try:
+                    desc, took = future.result()
+                    out, res = attach(desc)
+                    res = res.copy()
+                    out.close()
+                    out.unlink()
+                except Exception as e:
+                    print(e)
+                    res, took = None, 0.
+                finally:
+                    shm.close()
+                    shm.unlink()
+
+                self.stats['images'] += 1
+                self.stats['pixels'] += shape[0] * shape[1]
+                self.stats['busy']   += took
+
+                submit()
+                yield res, took
+
+        finally:
+            # Left early, the images still in flight are dropped along with
+            # the results of those already taken by a worker
+            for shm, _, future in pending:
+                if not future.cancel():
+                    try:
+                        drop(future.result()[0])
+                    except Exception:
+                        pass
+
+                shm.close()
+                shm.unlink()
+
+    def apply(self, filter, img):
+        # A single image, filters working channel by channel get a process
+        # per channel writing into one shared buffer, others run right here
+        start = perf_counter()
+        if not filter.CHANNELWISE:
+            res  = filter.apply(img)
+            busy = perf_counter() - start
+        else:
+            colors, keep = filter.split(img)
+            if not len(keep):
+                return img
+
+            shm, desc   = share(np.ascontiguousarray(colors))
+            planes      = filter.get_planes(colors)
+            out, odesc  = share(planes)
+            try:
+                futures = [self.executor.submit(work_channel, filter, desc, dim, odesc) for dim in keep]
+                busy    = sum(future.result() for future in futures)
+                planes  = np.ndarray(planes.shape, dtype = planes.dtype, buffer = out.buf)
+                res     = filter.merge(planes)
+            except Exception as e:
+                print(e)
+                res, busy = None, 0.
+            finally:
+                del planes
+                shm.close()
+                shm.unlink()
+                out.close()
+                out.unlink()
+
+        self.stats['images'] += 1
+        self.stats['pixels'] += img.shape[0] * img.shape[1]
+        self.stats['busy']   += busy
+        return res
+
+    def map(self, filter, images):
+        return [res for res, _ in self.imap(filter, images)]
+
+    def report(self):
+        wall = perf_counter() - self.stats['start']
+        return '{} image(s), {:.2f} Mpixel/s, {:.1f}x busy on {} processes'.format(
+            self.stats['images'], self.stats['pixels'] / wall / 1e6, self.stats['busy'] / wall, self.processes,
+        )
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,495 @@
+from dsp_fpga.tp_final.protocol import (
+    decode_response, REUSE_KERNEL, BAUD, COMPRESS, SEPARABLE, BORDER_ZERO, BORDER_REPLICATE, BORDER_MIRROR, BORDER_SHIFT,
+    PACK_PIXELS, PACK_RESPONSES, RUN, OUTPUT_WRAP24, OUTPUT_SHIFT, OUTPUTS, EMULATOR_URL, BASE_BAUDRATE, remap, scale_responses,
+)
+
+import numpy as np
+
+from collections import deque
+from threading import Thread, Condition
+from urllib.parse import urlparse, parse_qs
+from time import time, sleep
+import argparse
+
+def convolve(img, kernel, rows, c0, c1, border):
+    # Outputs c0 to c1 of the given row, reading only the pixels it needs
+    kernel = np.asarray(kernel, dtype = np.int64)
+    k      = kernel.shape[0]
+    h, w   = img.shape
+
+    ri, rvalid = remap(np.arange(rows - k//2, rows + k//2 + 1), h, border)
+    ci, cvalid = remap(np.arange(c0 - k//2, c1 + k//2), w, border)
+
+    band    = img[ri][:, ci].astype(np.int64) * rvalid[:, None] * cvalid[None, :]
+    windows = np.lib.stride_tricks.sliding_window_view(band, (k, k))[0]
+    return np.einsum('ckl,kl->c', windows, kernel[::-1, ::-1])
+
+class Emulator:
+
+    # Must match hdl/top.py and hdl/kernel_filter.py
+    RX_FIFO_DEPTH = 256
+    TX_FIFO_DEPTH = 256
+    KERNEL_SIZE   = 11
+    CLOCK_FREQ    = int(50e6)
+    BAUDRATE      = BASE_BAUDRATE
+
+    RESPONSE_BYTES = 3
+
+    def __init__(self, timeout = 5., kernel_size = KERNEL_SIZE):
+        self.timeout     = timeout
+        self.kernel_size = kernel_size
+        self.rfifo       = bytearray()
+        self.tfifo       = bytearray()
+        self.kernel      = np.zeros((1, 1), dtype = np.int64)
+        self.border      = BORDER_ZERO
+        self.shift       = 0
+        self.output      = OUTPUT_WRAP24
+        self.overflows   = 0
+        self.line_break()
+
+    def resync(self):
+        self.state    = 'KERNEL'
+        self.header   = bytearray()
+        self.last     = time()
+        self.rfifo.clear()
+
+    def line_break(self):
+        # Unlike a timeout, a break also takes the uart back to its first rate
+        self.divisor = int(self.CLOCK_FREQ / self.BAUDRATE)
+        self.pending = None
+        self.packing = 0
+        self.resync()
+
+    @property
+    def baudrate(self):
+        return self.CLOCK_FREQ / self.divisor
+
+    def switch(self):
+        # The new divisor is taken once the acknowledge is out of the tfifo
+        # and off the line
+        if self.pending is not None and not self.tfifo:
+            self.divisor = self.pending
+            self.pending = None
+
+    def receive(self, data):
+        # Bytes arriving while the rfifo is full are lost, as on the board
+        room = self.RX_FIFO_DEPTH - len(self.rfifo)
+
+        self.rfifo += data[:room]
+        self.overflows += max(0, len(data) - room)
+        self.step()
+
+    def step(self):
+        while self.advance():
+            self.last = time()
+
+        if self.state != 'KERNEL' and time() - self.last > self.timeout:
+            self.resync()
+
+    def take(self, n):
+        data = bytes(self.rfifo[:n])
+        del self.rfifo[:n]
+        return data
+
+    def advance(self):
+        if self.state == 'KERNEL':
+            if not self.rfifo:
+                return False
+
+            size = self.take(1)[0]
+            if size == REUSE_KERNEL:
+                self.state = 'SIZE'
+            elif size == BAUD:
+                self.state = 'BAUD'
+            elif size == COMPRESS:
+                self.state = 'COMPRESS'
+            elif (size >> BORDER_SHIFT) & 0x3 == 0x3:
+                pass
+            else:
+                self.k      = (size & 0x1F) | 1
+                self.sep    = bool(size & SEPARABLE)
+                self.border = (size >> BORDER_SHIFT) & 0x3
+                if self.border not in (BORDER_REPLICATE, BORDER_MIRROR):
+                    self.border = BORDER_ZERO
+                self.state  = 'SCALE'
+
+            return True
+
+        if self.state == 'ACK':
+            if len(self.tfifo) + self.RESPONSE_BYTES > self.TX_FIFO_DEPTH:
+                return False
+
+            self.tfifo  += self.encode(np.array([self.request]))
+            self.pending = self.request
+            self.state   = 'KERNEL'
+            return True
+
+        if self.state in ('SCALE', 'COEFS', 'SIZE', 'BAUD', 'COMPRESS'):
+            need = 1 if self.state in ('SCALE', 'COMPRESS') else 4
+            if self.state == 'COEFS':
+                need = 2 * (2 * self.k if self.sep else self.k**2)
+            if not self.rfifo:
+                return False
+
+            self.header += self.take(need - len(self.header))
+            if len(self.header) < need:
+                return True
+
+            if self.state == 'SCALE':
+                self.shift  = self.header[0] & 0x1F
+                self.output = (self.header[0] >> OUTPUT_SHIFT) & 0x3
+                self.state  = 'COEFS'
+
+            elif self.state == 'COEFS':
+                coefs = np.frombuffer(bytes(self.header), dtype = '<i2').astype(np.int64)
+                if self.sep:
+                    self.kernel = np.outer(coefs[: self.k], coefs[self.k :])
+                else:
+                    self.kernel = coefs.reshape(self.k, self.k)
+                self.state  = 'SIZE'
+
+            elif self.state == 'BAUD':
+                self.request = int(np.frombuffer(bytes(self.header), dtype = '<u4')[0])
+                self.state   = 'ACK'
+
+            elif self.state == 'COMPRESS':
+                self.packing = self.header[0]
+                self.state   = 'KERNEL'
+
+            else:
+                h, w = np.frombuffer(bytes(self.header), dtype = '<u2').astype(int)
+                self.img      = np.zeros((h, w), dtype = np.uint8)
+                self.consumed = 0
+                self.produced = 0
+                self.packet   = (False, 0, 0)
+                self.pixel    = 0
+                self.value    = 0
+                self.state    = 'STREAM' if h * w else 'KERNEL'
+
+            self.header.clear()
+            return True
+
+        # Output q is computed once pixel q + lead is in, and KernelFilter
+        # does not take pixels beyond that until it could hand over the output.
+        # Both limits are worked out at once for whatever the fifos allow.
+        h, w  = self.img.shape
+        halfk = self.kernel_size // 2
+        lead  = halfk * w + halfk
+
+        # Pixels still in the rfifo are copied in ahead, the outputs only read
+        # those taken by the end of the step.
+        ahead = self.unpack(h * w - self.consumed)
+        avail = self.consumed + len(ahead)
+        self.img.flat[self.consumed : avail] = ahead
+
+        ready = h * w if avail == h * w else max(0, avail - lead)
+        room  = self.TX_FIFO_DEPTH - len(self.tfifo)
+        width = OUTPUTS[self.output][0]
+        m     = max(0, min(ready - self.produced, room // width))
+        data  = b''
+
+        # Packed outputs take from one byte to as many as they need
+        if self.packing & PACK_RESPONSES:
+            m = max(0, min(ready - self.produced, room))
+            if m > 0:
+                data, m = self.pack(self.outputs(self.produced, self.produced + m), room)
+
+        elif m > 0:
+            data = self.encode(self.outputs(self.produced, self.produced + m), width)
+
+        n = min(avail, self.produced + m + lead + 1) - self.consumed
+
+        if n > 0:
+            self.unpack(n, commit = True)
+            self.consumed += n
+
+        if m > 0:
+            self.tfifo += data
+            self.produced += m
+
+        if self.produced == h * w:
+            self.state = 'KERNEL'
+
+        return n > 0 or m > 0
+
+    def unpack(self, limit, commit = False):
+        # Up to limit pixels out of the rfifo, reading packets as
+        # hdl/compression.py does, only as pixels are taken
+        if not self.packing & PACK_PIXELS:
+            return np.frombuffer(self.take(limit) if commit else bytes(self.rfifo[:limit]), dtype = np.uint8)
+
+        run, left, delta = self.packet
+        deltas = []
+        pos    = 0
+        count  = 0
+        while count < limit:
+            if not left:
+                if pos >= len(self.rfifo) or (self.rfifo[pos] & RUN and pos + 1 >= len(self.rfifo)):
+                    break
+
+                run   = bool(self.rfifo[pos] & RUN)
+                left  = (self.rfifo[pos] & 0x7F) + 1
+                pos  += 1
+                if run:
+                    delta = self.rfifo[pos]
+                    pos  += 1
+
+            n = min(left, limit - count) if run else min(left, limit - count, len(self.rfifo) - pos)
+            if not n:
+                break
+
+            if run:
+                deltas.append(np.full(n, delta, dtype = np.uint8))
+            else:
+                deltas.append(np.frombuffer(bytes(self.rfifo[pos : pos + n]), dtype = np.uint8))
+                pos += n
+
+            left  -= n
+            count += n
+
+        pixels = (self.pixel + np.cumsum(np.concatenate(deltas or [[]]).astype(np.int64))) & 0xFF
+        if commit:
+            del self.rfifo[:pos]
+            self.packet = (run, left, delta)
+            self.pixel  = int(pixels[-1]) if len(pixels) else self.pixel
+
+        return pixels.astype(np.uint8)
+
+    def outputs(self, q0, q1):
+        w   = self.img.shape[1]
+        res = []
+        while q0 < q1:
+            row, c0 = divmod(q0, w)
+            c1 = min(w, c0 + q1 - q0)
+            res.append(convolve(self.img, self.kernel, row, c0, c1, self.border))
+            q0 += c1 - c0
+
+        return scale_responses(np.concatenate(res), self.shift, self.output)
+
+    def encode(self, values, width = RESPONSE_BYTES):
+        words = (values & 0xFFFFFF).astype('<u4').view(np.uint8).reshape(-1, 4)
+        return words[:, : width].tobytes()
+
+    def pack(self, values, room):
+        # As many values as fit in room bytes, as hdl/compression.py packs them
+        bits    = 8 * self.RESPONSE_BYTES
+        mask    = (1 << bits) - 1
+        ngroups = -(-bits // 7)
+
+        values  = values & mask
+        delta   = (values - np.append(self.value if self.produced else 0, values[:-1])) & mask
+        zigzag  = ((delta << 1) & mask) ^ np.where(delta >> (bits - 1), mask, 0)
+        length  = 1 + sum((zigzag >> (7 * i)) != 0 for i in range(1, ngroups))
+
+        m       = int(np.searchsorted(np.cumsum(length), room, side = 'right'))
+        groups  = (zigzag[:m, None] >> (7 * np.arange(ngroups))) & 0x7F
+        more    = np.arange(ngroups) < (length[:m, None] - 1)
+        data    = (groups | (more << 7))[np.arange(ngroups) < length[:m, None]]
+
+        if m:
+            self.value = int(values[m - 1])
+
+        return data.astype(np.uint8).tobytes(), m
+
+class EmulatedSerial:
+
+    # Stands in for serial.Serial, with the emulator on the other end of a
+    # line of the given baudrate and latency
+    URL   = EMULATOR_URL
+    TICK  = 1e-3
+    # Bytes on the line between two updates of the emulator within a tick
+    SLICE = 16
+    # Largest mismatch between the rates of both ends that still gets through
+    BAUDRATE_ERROR = .03
+
+    def __init__(self, port = None, baudrate = BASE_BAUDRATE, timeout = None, latency = 0., **kwargs):
+        self.port     = port
+        self.baudrate = baudrate
+        self.timeout  = timeout
+        self.latency  = latency
+        self.fpga     = Emulator(**kwargs)
+        self.rng      = np.random.default_rng(0)
+        self.cond     = Condition()
+        self.is_open  = False
+
+        if port is not None:
+            query = parse_qs(urlparse(port).query)
+            if 'latency' in query:
+                self.latency = float(query['latency'][0])
+            if 'timeout' in query:
+                self.fpga.timeout = float(query['timeout'][0])
+
+        self.open()
+
+    @property
+    def byte_time(self):
+        return 10 / self.baudrate
+
+    @property
+    def in_waiting(self):
+        with self.cond:
+            return len(self.received)
+
+    def open(self):
+        if self.is_open:
+            return
+
+        self.wire_in  = deque()
+        self.wire_out = deque()
+        self.received = bytearray()
+        self.tx_free  = 0.
+        self.rx_free  = 0.
+        self.now      = time()
+        self.is_open  = True
+
+        self.worker = Thread(target = self.run, daemon = True)
+        self.worker.start()
+
+    def close(self):
+        with self.cond:
+            self.is_open = False
+            self.cond.notify_all()
+
+    def write(self, data):
+        data = bytes(data)
+        with self.cond:
+            if not self.is_open:
+                raise IOError("Port is closed")
+
+            start = max(time(), self.tx_free)
+            self.tx_free = start + len(data) * self.byte_time
+            self.wire_in.append([start, data])
+
+        return len(data)
+
+    def read(self, size = 1):
+        deadline = None if self.timeout is None else time() + self.timeout
+        with self.cond:
+            while self.is_open and len(self.received) < size:
+                left = None if deadline is None else deadline - time()
+                if left is not None and left <= 0:
+                    break
+                self.cond.wait(left)
+
+            data = bytes(self.received[:size])
+            del self.received[:size]
+            return data
+
+    def reset_input_buffer(self):
+        with self.cond:
+            self.received.clear()
+
+    def reset_output_buffer(self):
+        # Drops whatever has not started its way down the line
+        now = time()
+        with self.cond:
+            wire = deque()
+            for start, data in self.wire_in:
+                sent = max(0, min(len(data), int((now - start) / self.byte_time) + 1))
+                if sent:
+                    wire.append([start, data[:sent]])
+                    self.tx_free = start + sent * self.byte_time
+
+            self.wire_in = wire
+            if not wire:
+                self.tx_free = now
+
+    def send_break(self, duration = .25):
+        sleep(duration)
+        with self.cond:
+            self.fpga.line_break()
+
+    def garble(self, data):
+        # Bytes sent at a rate the other end does not expect come out as noise
+        if abs(self.baudrate / self.fpga.baudrate - 1) <= self.BAUDRATE_ERROR:
+            return data
+
+        return bytes(self.rng.integers(0, 256, len(data), dtype = np.uint8))
+
+    def arrived(self, wire, now):
+        # Bytes of the wire that made it to the other end by now
+        res = bytearray()
+        while wire:
+            start, data = wire[0]
+            n = min(len(data), int((now - self.latency - start) / self.byte_time))
+            if n <= 0:
+                break
+
+            res += data[:n]
+            if n == len(data):
+                wire.popleft()
+            else:
+                wire[0] = [start + n * self.byte_time, data[n:]]
+
+        return res
+
+    def transmit(self, now):
+        # The uart sends from the tfifo as fast as the line allows
+        n = min(len(self.fpga.tfifo), int((now - self.rx_free) / self.byte_time) + 1)
+        if n > 0:
+            self.wire_out.append([self.rx_free, self.garble(bytes(self.fpga.tfifo[:n]))])
+            self.rx_free += n * self.byte_time
+            del self.fpga.tfifo[:n]
+            self.fpga.step()
+
+        if not self.fpga.tfifo and now >= self.rx_free:
+            self.fpga.switch()
+            self.rx_free = now
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.is_open:
+                    return
+
+                # Both ends are updated in small steps, so that the fifos fill
+                # and drain in about the same order as they would on the board
+                now = time()
+                while self.now < now:
+                    self.now = min(now, self.now + self.SLICE * self.byte_time)
+                    self.fpga.receive(self.garble(self.arrived(self.wire_in, self.now)))
+                    self.transmit(self.now)
+
+                data = self.arrived(self.wire_out, now)
+                if data:
+                    self.received += data
+                    self.cond.notify_all()
+
+            sleep(self.TICK)
+
+if __name__ == '__main__':
+    from dsp_fpga.tp_final.session import Session
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--height', required = False, type = int, default = 64)
+    parser.add_argument('--width', required = False, type = int, default = 64)
+    parser.add_argument('--channels', required = False, type = int, default = 3)
+    parser.add_argument('--size', required = False, type = int, default = 11)
+    parser.add_argument('--baudrate', required = False, type = int, default = BASE_BAUDRATE)
+    parser.add_argument('--latency', required = False, type = float, default = 0.)
+    parser.add_argument('--runs', required = False, type = int, default = 2)
+    args = parser.parse_args()
+
+    rng    = np.random.default_rng(0)
+    img    = rng.integers(0, 256, (args.height, args.width, args.channels), dtype = np.uint8)
+    kernel = rng.integers(-128, 128, (args.size, args.size))
+
+    session = Session('{}?latency={}'.format(EmulatedSerial.URL, args.latency), args.baudrate, 10)
+    fpga    = session.uart.dev.fpga
+    ideal   = img.size * Emulator.RESPONSE_BYTES * 10 / args.baudrate
+    ref     = np.stack([
+        np.stack([convolve(img[:, :, dim], kernel, row, 0, args.width, BORDER_ZERO) for row in range(args.height)])
+        for dim in range(args.channels)
+    ], axis = -1)
+    ref     = decode_response(fpga.encode(ref.reshape(-1)), Emulator.RESPONSE_BYTES).reshape(ref.shape)
+
+    for run in range(args.runs):
+        start = time()
+        res   = session.run(img, kernel)
+        took  = time() - start
+
+        ok = res is not None and (res == ref).all()
+        print('run {}: {} in {:.2f}s, {:.0%} of the line rate'.format(run, 'ok' if ok else 'MISMATCH', took, ideal / took))
+
+    print('rfifo overflows: {}'.format(fpga.overflows))
+    session.close()
@@ -1,22 +1,33 @@
-from PyQt5.QtWidgets import QWidget, QLabel, QDoubleSpinBox, QVBoxLayout, QHBoxLayout
-import numpy as np
-import cv2
-import random
-import bisect
+from PyQt5.QtWidgets import QWidget, QLabel, QDoubleSpinBox, QVBoxLayout, QHBoxLayout, QComboBox
 from PyQt5.QtCore import Qt
-from skimage.transform import downscale_local_mean
-from PIL import Image, ImageEnhance
-from skimage.transform.radon_transform import radon, iradon
-from skimage import restoration, color
+from dsp_fpga.tp_final import core
 
 class Filter(QWidget):
-    def __init__(self, name, *args, **kwargs):
+
+    # The filter doing the work, see core/filters.py, and the widgets holding
+    # each of its parameters
+    CORE    = core.Filter
+    WIDGETS = {}
+
+    def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.name = name
-        self.hw   = False
+        self.core = self.CORE()
+        self.name = self.core.name
+        self.hw   = self.core.hw
+
+    def get_params(self):
+        params = {}
+        for param, attr in self.WIDGETS.items():
+            widget = getattr(self, attr)
+            if isinstance(widget, QComboBox):
+                params[param] = widget.currentText()
+            else:
+                params[param] = widget.value()
+
+        return params
 
     def apply(self, img):
-        return img
+        return self.core.configure(**self.get_params()).apply(img)
 
     def __le__(self, other):
         return self.name <= other.name
@@ -31,11 +42,17 @@ class Filter(QWidget):
         return self.name > other.name
 
 class HWFilter(Filter):
-    MAX_KERNEL_SIZE = 11
+    CORE    = core.HWFilter
+    WIDGETS = {
+        'size'      : 'spinbox',
+        'border'    : 'border',
+        'output'    : 'output',
+    }
 
-    def __init__(self, name, *args, **kwargs):
-        super().__init__(name, *args, **kwargs)
-        self.hw   = True
+    MAX_KERNEL_SIZE = core.HWFilter.MAX_KERNEL_SIZE
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
 
         self.main_layout = QVBoxLayout(self)
         self.label       = QLabel(self, text = 'Kernel size')
@@ -48,6 +65,22 @@ class HWFilter(Filter):
         self.spinbox.setMaximum(self.MAX_KERNEL_SIZE)
         self.spinbox.setSingleStep(1)
 
+        self.blabel      = QLabel(self, text = 'Border')
+        self.border      = QComboBox(self)
+
+        self.border.addItems(core.BORDERS.keys())
+
+        self.main_layout.addWidget(self.blabel, alignment = Qt.AlignCenter)
+        self.main_layout.addWidget(self.border, alignment = Qt.AlignCenter)
+
+        self.olabel      = QLabel(self, text = 'Output')
+        self.output      = QComboBox(self)
+
+        self.output.addItems(core.OUTPUTS.keys())
+
+        self.main_layout.addWidget(self.olabel, alignment = Qt.AlignCenter)
+        self.main_layout.addWidget(self.output, alignment = Qt.AlignCenter)
+
         self.last = 1
 
         self.spinbox.valueChanged.connect(self.set_new)
@@ -67,18 +100,29 @@ class HWFilter(Filter):
                 self.last = new
 
     def get_kernel(self):
-        return np.array([1])
+        return self.core.configure(**self.get_params()).get_kernel()
 
-class Identity(Filter):
-    def __init__(self, *args, **kwargs):
-        super().__init__('Identity', *args, **kwargs)
+    def get_border(self):
+        return self.core.configure(**self.get_params()).get_border()
 
-    def apply(self, img):
-        return img
+    def valid_size(self):
+        return self.core.configure(**self.get_params()).valid_size()
+
+    def get_hw_kernel(self):
+        return self.core.configure(**self.get_params()).get_hw_kernel()
+
+    def get_hw_scale(self):
+        return self.core.configure(**self.get_params()).get_hw_scale()
+
+class Identity(Filter):
+    CORE    = core.Identity
 
 class GaussianBlur(HWFilter):
+    CORE    = core.GaussianBlur
+    WIDGETS = {**HWFilter.WIDGETS, 'sigma': 'fspinbox'}
+
     def __init__(self, *args, **kwargs):
-        super().__init__('Gaussian blur', *args, **kwargs)
+        super().__init__(*args, **kwargs)
         self.flabel       = QLabel(self, text = 'Sigma')
         self.fspinbox     = QDoubleSpinBox(self)
 
@@ -91,31 +135,15 @@ class GaussianBlur(HWFilter):
         self.main_layout.addWidget(self.flabel  , alignment = Qt.AlignCenter)
         self.main_layout.addWidget(self.fspinbox, alignment = Qt.AlignCenter)
 
-    @staticmethod
-    def gaussian_filter(k, sigma):
-        def get_axis(x, y):
-            return np.repeat([np.arange(x)], y, axis = 0).astype(float)
-
-        x = get_axis(k, k)
-        center = (k - 1)//2
-        D = ((x.T - center)**2 + (x - center)**2)
-        return 1/(2 * np.pi * sigma**2) * np.exp(-D/(2 * sigma**2))
-
-    def get_kernel(self):
-        k = self.gaussian_filter(int(self.spinbox.value()), self.fspinbox.value())
-        return (k / abs(k.min())).round().astype(np.uint8)
-
 class BoxBlur(HWFilter):
-    def __init__(self, *args, **kwargs):
-        super().__init__('Box blur', *args, **kwargs)
-
-    def get_kernel(self):
-        k = int(self.spinbox.value())
-        return np.ones((k, k), dtype = np.uint8)
+    CORE    = core.BoxBlur
 
 class RidgeDetection(HWFilter):
+    CORE    = core.RidgeDetection
+    WIDGETS = {**HWFilter.WIDGETS, 'center': 'fspinbox'}
+
     def __init__(self, *args, **kwargs):
-        super().__init__('Ridge Detection', *args, **kwargs)
+        super().__init__(*args, **kwargs)
         self.flabel       = QLabel(self, text = 'Center')
         self.fspinbox     = QDoubleSpinBox(self)
 
@@ -126,15 +154,12 @@ class RidgeDetection(HWFilter):
         self.main_layout.addWidget(self.flabel  , alignment = Qt.AlignCenter)
         self.main_layout.addWidget(self.fspinbox, alignment = Qt.AlignCenter)
 
-    def get_kernel(self):
-        k = int(self.spinbox.value())
-        res = np.full((k, k), -1)
-        res[k//2, k//2] = int(self.fspinbox.value())
-        return res
-
 class Sharpen(HWFilter):
+    CORE    = core.Sharpen
+    WIDGETS = {**HWFilter.WIDGETS, 'center': 'fspinbox'}
+
     def __init__(self, *args, **kwargs):
-        super().__init__('Sharpen', *args, **kwargs)
+        super().__init__(*args, **kwargs)
         self.flabel       = QLabel(self, text = 'Center')
         self.fspinbox     = QDoubleSpinBox(self)
 
@@ -145,96 +170,51 @@ class Sharpen(HWFilter):
         self.main_layout.addWidget(self.flabel  , alignment = Qt.AlignCenter)
         self.main_layout.addWidget(self.fspinbox, alignment = Qt.AlignCenter)
 
-    def get_kernel(self):
-        k = int(self.spinbox.value())
-
-        res = np.full((k, k), -1)
-        res[0, 0] = res[k-1, 0] = res[0, k-1] = res[k-1, k-1] = 0
-        res[k//2, k//2] = int(self.fspinbox.value())
-        return res
-
 class Negative(Filter):
-    def __init__(self, *args, **kwargs):
-        super().__init__('Negative', *args, **kwargs)
-
-    def apply(self, img):
-        norm = ((img - img.min()) / abs(img - img.min()).max() * 255).astype(np.uint8)
-        
-        if len(img.shape) == 1:
-            print("Invalid image shape")
-            return img
-
-        if len(img.shape) == 2:
-            return 255 - norm
-        elif img.shape[2] <= 3:
-            return 255 - norm
-        else:
-            return 255 - norm[:, :, :-1]
+    CORE    = core.Negative
 
 class SaltnPepper(Filter):
-
-    MIN_CHANGE = 0.05
-    MAX_CHANGE = 0.25
+    CORE    = core.SaltnPepper
+    WIDGETS = {
+        'density'   : 'density',
+        'seed'      : 'seed',
+    }
 
     def __init__(self, *args, **kwargs):
-        super().__init__('Salt and pepper', *args, **kwargs)
-
-    def apply(self, img):
-        if len(img.shape) not in [2, 3]:
-            print("Invalid image shape")
-            return img
-
-        if len(img.shape) == 2:
-            img = img.reshape(*img.shape, 1)
-
-        res = []
-        row , col = img.shape[:2]
-
-        tot = row * col
-        number_of_pixels = random.randint(int(self.MIN_CHANGE*tot), int(self.MAX_CHANGE*tot))
-
-        windices = [
-            (random.randint(0, row-1), random.randint(0, col-1)) for _ in range(number_of_pixels)
-        ]
-        bindices = [
-            (random.randint(0, row-1), random.randint(0, col-1)) for _ in range(number_of_pixels)
-        ]
-
-        for dim in range(img.shape[2]):
-            _img = img[:, :, dim]
-            if not abs(_img - _img.min()).max():
-                continue
-
-            _img = ((_img - _img.min()) / abs(_img - _img.min()).max() * 255).astype(np.uint8)
+        super().__init__(*args, **kwargs)
 
-            if dim >= 3:
-                res.append(_img.reshape(*_img.shape, 1))
-                continue
+        self.main_layout = QVBoxLayout(self)
+        self.density     = QDoubleSpinBox(self)
+        self.label       = QLabel(self, text = 'Density (0 for random)')
 
-            for y_coord, x_coord in windices:
-                # Color that pixel to white
-                _img[y_coord][x_coord] = 255
+        self.density.setMinimum(0)
+        self.density.setMaximum(1)
+        self.density.setSingleStep(0.05)
 
-            for y_coord, x_coord in bindices:
-                # Color that pixel to black
-                _img[y_coord][x_coord] = 0
+        self.main_layout.addWidget(self.label, alignment = Qt.AlignCenter)
+        self.main_layout.addWidget(self.density, alignment = Qt.AlignCenter)
 
-            res.append(_img)
-            res[-1] = res[-1].reshape(*res[-1].shape, 1)
+        # Same seed as batch.py --param seed, for results that can be repeated
+        self.seed        = QDoubleSpinBox(self)
+        self.slabel      = QLabel(self, text = 'Seed (-1 for random)')
 
+        self.seed.setDecimals(0)
+        self.seed.setMinimum(-1)
+        self.seed.setMaximum(2**31 - 1)
+        self.seed.setSingleStep(1)
+        self.seed.setValue(-1)
 
-        res = np.concatenate(tuple(res), axis = -1).astype(float)
-        if res.shape[2] == 1:
-            res = res.reshape(*res.shape[:2])
-    
-        return (res - res.min()) / abs(res - res.min()).max()
+        self.main_layout.addWidget(self.slabel, alignment = Qt.AlignCenter)
+        self.main_layout.addWidget(self.seed, alignment = Qt.AlignCenter)
 
 class Median(Filter):
+    CORE    = core.Median
+    WIDGETS = {'size': 'spinbox'}
 
     MAX_KERNEL_SIZE = 5
 
     def __init__(self, *args, **kwargs):
-        super().__init__('Median', *args, **kwargs)
+        super().__init__(*args, **kwargs)
 
         self.main_layout = QVBoxLayout(self)
         self.label       = QLabel(self, text = 'Kernel size')
@@ -265,50 +245,21 @@ class Median(Filter):
             else:
                 self.last = new
 
-    def apply(self, img):
-        try:
-            return cv2.medianBlur(img, int(self.spinbox.value()))
-        except Exception as e:
-            print(e)
-            return img
-
 class Histogram(Filter):
-
-    def __init__(self, *args, **kwargs):
-        super().__init__('Histogram', *args, **kwargs)
-
-    def apply(self, img):
-        try:
-            if len(img.shape) not in [2, 3]:
-                print("Invalid image shape")
-                return img
-
-            if len(img.shape) == 2:
-                img = img.reshape(*img.shape, 1)
-
-            res = []
-
-            for dim in range(img.shape[2]):
-                _img = img[:, :, dim]
-                if not abs(_img - _img.min()).max():
-                    continue
-                _img = ((_img - _img.min()) / abs(_img - _img.min()).max() * 255).astype(np.uint8)
-
-                res.append(np.hstack((_img, cv2.equalizeHist(_img))))
-                res[-1] = res[-1].reshape(*res[-1].shape, 1)
-
-            res = np.concatenate(tuple(res), axis = -1).astype(float)
-            if res.shape[2] == 1:
-                res = res.reshape(*res.shape[:2])
-            return (res - res.min()) / abs(res - res.min()).max()
-
-        except Exception as e:
-            print(e)
-            return img
+    CORE    = core.Histogram
 
 class ImAdjust(Filter):
+    CORE    = core.ImAdjust
+    WIDGETS = {
+        'vin_min'   : 'vin_min',
+        'vin_max'   : 'vin_max',
+        'vout_min'  : 'vout_min',
+        'vout_max'  : 'vout_max',
+        'tol'       : 'tol',
+    }
+
     def __init__(self, *args, **kwargs):
-        super().__init__('ImAdjust', *args, **kwargs)
+        super().__init__(*args, **kwargs)
 
         self.main_layout = QVBoxLayout(self)
 
@@ -403,129 +354,15 @@ class ImAdjust(Filter):
             self.vin_max_label.show()
             self.vin_max.show()
 
-    def apply(self, img):
-        # def imadjust(src, tol=1, vin=[0,255], vout=(0,255)):
-        # src : input one-layer image (numpy array)
-        # tol : tolerance, from 0 to 100.
-        # vin  : src image bounds
-        # vout : dst image bounds
-        # return : output img
-
-        if len(img.shape) not in [2, 3]:
-            print("Invalid image shape")
-            return img
-
-        if len(img.shape) == 2:
-            img = img.reshape(*img.shape, 1)
-
-        res = np.zeros(img.shape, dtype = np.uint8)
-
-        res = []
-
-        for dim in range(img.shape[2]):
-            _img = img[:, :, dim]
-            if not abs(_img - _img.min()).max():
-                continue
-            _img = ((_img - _img.min()) / abs(_img - _img.min()).max() * 255).astype(np.uint8)
-
-            vin = [int(self.vin_min.value()), int(self.vin_max.value())]
-            vout = [int(self.vout_min.value()), int(self.vout_max.value())]
-            tol = int(self.tol.value())
-
-            tol = max(0, min(100, tol))
-
-            if tol > 0:
-                # Compute in and out limits
-                # Histogram
-                hist = np.histogram(_img, bins=list(range(256)),range=(0,255))[0]
-
-                # Cumulative histogram
-                cum = hist.copy()
-                for i in range(1, 255): cum[i] = cum[i - 1] + hist[i]
-
-                # Compute bounds
-                total = _img.shape[0] * _img.shape[1]
-                low_bound = total * tol / 100
-                upp_bound = total * (100 - tol) / 100
-                vin[0] = bisect.bisect_left(cum, low_bound)
-                vin[1] = bisect.bisect_left(cum, upp_bound)
-
-            # Stretching
-            scale = (vout[1] - vout[0]) / (vin[1] - vin[0])
-            vs = _img-vin[0]
-            vs[_img<vin[0]]=0
-            vd = vs*scale+0.5 + vout[0]
-            vd[vd>vout[1]] = vout[1]
-
-            res.append(vd)
-            res[-1] = res[-1].reshape(*res[-1].shape, 1)
-
-        res = np.concatenate(tuple(res), axis = -1).astype(float)
-
-        if res.shape[2] == 1:
-            res = res.reshape(*res.shape[:2])
-
-        return (res - res.min()) / abs(res - res.min()).max()
-
 class BitPlaneSlicing(Filter):
-
-    def __init__(self, *args, **kwargs):
-        super().__init__('Bit plane slicing', *args, **kwargs)
-
-    def apply(self, img):
-        try:
-            if len(img.shape) not in [2, 3]:
-                print("Invalid image shape")
-                return img
-
-            if len(img.shape) == 2:
-                img = img.reshape(*img.shape, 1)
-
-            res = []
-
-            for dim in range(img.shape[2]):
-                _img = img[:, :, dim]
-                if not abs(_img - _img.min()).max():
-                    continue
-                _img = ((_img - _img.min()) / abs(_img - _img.min()).max() * 255).astype(np.uint8)
-
-                lst = []
-                for i in range(img.shape[0]):
-                    for j in range(img.shape[1]):
-                        lst.append(np.binary_repr(_img[i][j] ,width=8)) # width = no. of bits
-
-                # We have a list of strings where each string represents binary pixel value. To extract bit planes we need to iterate over the strings and store the characters corresponding to bit planes into lists.
-                # Multiply with 2^(n-1) and reshape to reconstruct the bit image.
-                eight_bit_img = (np.array([int(i[0]) for i in lst],dtype = np.uint8) * 128).reshape(*_img.shape)
-                seven_bit_img = (np.array([int(i[1]) for i in lst],dtype = np.uint8) * 64).reshape(*_img.shape)
-                six_bit_img = (np.array([int(i[2]) for i in lst],dtype = np.uint8) * 32).reshape(*_img.shape)
-                five_bit_img = (np.array([int(i[3]) for i in lst],dtype = np.uint8) * 16).reshape(*_img.shape)
-                four_bit_img = (np.array([int(i[4]) for i in lst],dtype = np.uint8) * 8).reshape(*_img.shape)
-                three_bit_img = (np.array([int(i[5]) for i in lst],dtype = np.uint8) * 4).reshape(*_img.shape)
-                two_bit_img = (np.array([int(i[6]) for i in lst],dtype = np.uint8) * 2).reshape(*_img.shape)
-                one_bit_img = (np.array([int(i[7]) for i in lst],dtype = np.uint8) * 1).reshape(*_img.shape)
-
-                #Concatenate these images for ease of display using cv2.hconcat()
-                finalr = cv2.hconcat([eight_bit_img,seven_bit_img,six_bit_img,five_bit_img])
-                finalv =cv2.hconcat([four_bit_img,three_bit_img,two_bit_img,one_bit_img])
-
-                # Vertically concatenate
-                final = cv2.vconcat([finalr,finalv])
-                res.append(final)
-                res[-1] = res[-1].reshape(*res[-1].shape, 1)
-
-            res = np.concatenate(tuple(res), axis = -1).astype(float)
-            if res.shape[2] == 1:
-                res = res.reshape(*res.shape[:2])
-            return (res - res.min()) / abs(res - res.min()).max()
-
-        except Exception as e:
-            print(e)
-            return img
+    CORE    = core.BitPlaneSlicing
 
 class BrightnessEnhancer(Filter):
+    CORE    = core.BrightnessEnhancer
+    WIDGETS = {'factor': 'factor'}
+
     def __init__(self, *args, **kwargs):
-        super().__init__('Brightness Enhancer', *args, **kwargs)
+        super().__init__(*args, **kwargs)
 
         self.main_layout = QVBoxLayout(self)
         self.factor      = QDoubleSpinBox(self)
@@ -536,28 +373,12 @@ class BrightnessEnhancer(Filter):
 
         self.main_layout.addWidget(self.factor, alignment = Qt.AlignCenter)
 
-    def apply(self, img):
-        try:
-            if len(img.shape) not in [2, 3]:
-                print("Invalid image shape")
-                return img
-
-            if len(img.shape) == 2:
-                res = img.reshape(*img.shape, 1)
-
-            else:
-                res = img
-
-            res = ((res - res.min()) / abs(res - res.min()).max() * 255).astype(np.uint8)
-            return ImageEnhance.Brightness(Image.fromarray(res)).enhance(self.factor.value())
-
-        except Exception as e:
-            print(e)
-            return img
-
 class ColorLimitation(Filter):
+    CORE    = core.ColorLimitation
+    WIDGETS = {'ncolors': 'ncolors'}
+
     def __init__(self, *args, **kwargs):
-        super().__init__('Color Limitation', *args, **kwargs)
+        super().__init__(*args, **kwargs)
 
         self.main_layout = QVBoxLayout(self)
         self.ncolors     = QDoubleSpinBox(self)
@@ -570,29 +391,12 @@ class ColorLimitation(Filter):
         self.main_layout.addWidget(self.label, alignment = Qt.AlignCenter)
         self.main_layout.addWidget(self.ncolors, alignment = Qt.AlignCenter)
 
-    def apply(self, img):
-        try:
-            if len(img.shape) not in [2, 3]:
-                print("Invalid image shape")
-                return img
-
-            if len(img.shape) == 2:
-                res = img.reshape(*img.shape, 1)
-
-            else:
-                res = img
-
-            res = ((res - res.min()) / abs(res - res.min()).max() * 255).astype(np.uint8)
-            
-            return Image.fromarray(res).quantize(int(self.ncolors.value()))
-
-        except Exception as e:
-            print(e)
-            return img
-
 class Downsampler(Filter):
+    CORE    = core.Downsampler
+    WIDGETS = {'factor': 'factor'}
+
     def __init__(self, *args, **kwargs):
-        super().__init__('Downsampler', *args, **kwargs)
+        super().__init__(*args, **kwargs)
 
         self.main_layout = QVBoxLayout(self)
         self.factor      = QDoubleSpinBox(self)
@@ -605,73 +409,19 @@ class Downsampler(Filter):
         self.main_layout.addWidget(self.label, alignment = Qt.AlignCenter)
         self.main_layout.addWidget(self.factor, alignment = Qt.AlignCenter)
 
-    def apply(self, img):
-        try:
-            if len(img.shape) not in [2, 3]:
-                print("Invalid image shape")
-                return img
-
-            if len(img.shape) == 2:
-                img = img.reshape(*img.shape, 1)
-
-            res = []
-
-            factor = int(self.factor.value())
-            for dim in range(img.shape[2]):
-                _img = img[:, :, dim]
-                _img = ((_img - _img.min()) / abs(_img - _img.min()).max() * 255).astype(np.uint8)
-                res.append(downscale_local_mean(_img, factors=(factor, factor)).astype(int))
-                res[-1] = res[-1].reshape(*res[-1].shape, 1)
-
-            res = np.concatenate(tuple(res), axis = -1).astype(float)
-            if res.shape[2] == 1:
-                res = res.reshape(*res.shape[:2])
-            return (res - res.min()) / abs(res - res.min()).max()
-
-        except Exception as e:
-            print(e)
-            return img
-
 class Logarithmic(Filter):
-    def __init__(self, *args, **kwargs):
-        super().__init__('Logarithmic', *args, **kwargs)
-
-    def apply(self, img):
-        try:
-            if len(img.shape) not in [2, 3]:
-                print("Invalid image shape")
-                return img
-
-            if len(img.shape) == 2:
-                img = img.reshape(*img.shape, 1)
-
-            res = []
-
-            for dim in range(img.shape[2]):
-                _img = img[:, :, dim]
-                _img = ((_img - _img.min()) / abs(_img - _img.min()).max() * 255).astype(float)
-                 # Apply log transformation method
-                c = 255 / np.log(1 + np.max(_img))
-
-                log_image = c * (np.log(_img + 1))
-
-                # Specify the data type so that
-                # float value will be converted to int
-                res.append(np.array(log_image, dtype = np.uint8))
-                res[-1] = res[-1].reshape(*res[-1].shape, 1)
-
-            res = np.concatenate(tuple(res), axis = -1).astype(float)
-            if res.shape[2] == 1:
-                res = res.reshape(*res.shape[:2])
-            return (res - res.min()) / abs(res - res.min()).max()
-
-        except Exception as e:
-            print(e)
-            return img
+    CORE    = core.Logarithmic
 
 class RadonDirect(Filter):
+    CORE    = core.RadonDirect
+    WIDGETS = {
+        'min_angle' : 'min_angle',
+        'max_angle' : 'max_angle',
+        'sample'    : 'sample',
+    }
+
     def __init__(self, *args, **kwargs):
-        super().__init__('Radon direct', *args, **kwargs)
+        super().__init__(*args, **kwargs)
 
         self.main_layout = QHBoxLayout(self)
 
@@ -718,34 +468,15 @@ class RadonDirect(Filter):
     def adapt_max(self, new_min):
         self.max_angle.setMinimum(new_min)
 
-    def apply(self, img):
-        if len(np.shape(img)) not in [2, 3]:
-            print("Invalid image shape")
-            return img
-
-        if len(img.shape) == 2:
-            img = img.reshape(*img.shape, 1)
-
-        minval = self.min_angle.value()
-        sample = self.sample.value()
-        maxval = self.max_angle.value()
-
-        res = []
-
-        for dim in range(img.shape[2]):
-            _img = img[:, :, dim]
-            _img = ((_img - _img.min()) / abs(_img - _img.min()).max() * 255).astype(float)
-            res.append(radon(_img, theta = np.linspace(minval, maxval, int(sample))))
-            res[-1] = res[-1].reshape(*res[-1].shape, 1)
-
-        res = np.concatenate(tuple(res), axis = -1).astype(float)
-        if res.shape[2] == 1:
-            res = res.reshape(*res.shape[:2])
-        return (res - res.min()) / abs(res - res.min()).max()
-
 class RadonInverse(Filter):
+    CORE    = core.RadonInverse
+    WIDGETS = {
+        'min_angle' : 'min_angle',
+        'max_angle' : 'max_angle',
+    }
+
     def __init__(self, *args, **kwargs):
-        super().__init__('Radon inverse', *args, **kwargs)
+        super().__init__(*args, **kwargs)
 
         self.main_layout = QHBoxLayout(self)
 
@@ -781,52 +512,17 @@ class RadonInverse(Filter):
     def adapt_max(self):
         self.max_angle.setMinimum(self.min_angle.value())
 
-    def apply(self, img):
-        if len(np.shape(img)) not in [2, 3]:
-            print("Invalid image shape")
-            return img
-
-        if len(img.shape) == 2:
-            img = img.reshape(*img.shape, 1)
-
-        minval = self.min_angle.value()
-        maxval = self.max_angle.value()
-        sample = np.shape(img)[1]
-        res = []
-
-        for dim in range(img.shape[2]):
-            _img = img[:, :, dim]
-            if abs(_img - _img.min()).max():
-                _img = ((_img - _img.min()) / abs(_img - _img.min()).max() * 255).astype(float)
-
-            res.append(iradon(_img, theta = np.linspace(minval, maxval, int(sample))))
-            res[-1] = res[-1].reshape(*res[-1].shape, 1)
-
-        res = np.concatenate(tuple(res), axis = -1).astype(float)
-
-        if res.shape[2] == 1:
-            res = res.reshape(*res.shape[:2])
-
-        return (res - res.min()) / abs(res - res.min()).max()
-
-
 class MotionBlur(HWFilter):
-    def __init__(self, *args, **kwargs):
-        super().__init__('Motion blur', *args, **kwargs)
-
-    def get_kernel(self):
-        size = int(self.spinbox.value())
-
-        kernel = np.zeros((size, size), dtype = np.uint16)
-        kernel[size//2, : ] = np.ones(size)
-
-        return kernel
+    CORE    = core.MotionBlur
 
 class MotionBlurSw(Filter):
+    CORE    = core.MotionBlurSw
+    WIDGETS = {'size': 'factor'}
+
     MAX_KERNEL_SIZE = 31
 
     def __init__(self, *args, **kwargs):
-        super().__init__('Motion blur (sw)', *args, **kwargs)
+        super().__init__(*args, **kwargs)
         self.main_layout = QVBoxLayout(self)
         self.factor      = QDoubleSpinBox(self)
         self.label       = QLabel(self, text = 'Kernel size')
@@ -854,18 +550,17 @@ class MotionBlurSw(Filter):
             else:
                 self.last = new
 
-    def apply(self, img):
-        size = int(self.factor.value())
-        kernel = np.zeros((size, size))
-        kernel[size//2, :] = 1
-        res = cv2.filter2D(img, -1, kernel).astype(float)
-        return (res - res.min()) / abs(res - res.min()).max()
-
 class Wiener(Filter):
+    CORE    = core.Wiener
+    WIDGETS = {
+        'size'      : 'factor',
+        'adjust'    : 'adjust',
+    }
+
     MAX_KERNEL_SIZE = 31
 
     def __init__(self, *args, **kwargs):
-        super().__init__('Wiener', *args, **kwargs)
+        super().__init__(*args, **kwargs)
         self.main_layout = QVBoxLayout(self)
         self.factor      = QDoubleSpinBox(self)
         self.label       = QLabel(self, text = 'Kernel size')
@@ -903,21 +598,3 @@ class Wiener(Filter):
                 self.factor.setValue(self.last)
             else:
                 self.last = new
-
-    def apply(self, img):
-        try:
-            size = int(self.factor.value())
-            balance = self.adjust.value()
-
-            if len(img.shape) >= 3:
-                img = color.rgb2gray(img[:, :, :3])
-
-            kernel = np.zeros((size, size))
-            kernel[size//2, :] = 1
-            res = restoration.wiener(img, psf = kernel, balance = balance).astype(float)
-
-            return (res - res.min()) / abs(res - res.min()).max()
-
-        except Exception as e:
-            print(e)
-            return img
\ No newline at end of file
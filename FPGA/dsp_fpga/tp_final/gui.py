@@ -1,6 +1,8 @@
 from dsp_fpga.tp_final.canvas import Canvas
-from dsp_fpga.tp_final.uart import Uart
+from dsp_fpga.tp_final.session import Session
+from dsp_fpga.tp_final.protocol import BORDER_ZERO, OUTPUT_WRAP24, BASE_BAUDRATE
 from dsp_fpga.tp_final.file import open_file, save_file
+from dsp_fpga.tp_final.core import quantize, normalize
 
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QComboBox, QFrame, QProgressBar
@@ -14,19 +16,23 @@ from time import sleep
 
 class Gui(QWidget):
 
-    KERNEL_SIZE    = 11
-    MAX_IMG_WIDTH  = 200
-    MAX_IMG_HEIGHT = 200
     RESPONSE_BYTES = 3
 
-    def __init__(self, port, baudrate, timeout, *args, **kwargs):
+    def __init__(self, port, baudrate, timeout, *args, packing = 0, base_baudrate = BASE_BAUDRATE, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.port     = port
         self.baudrate = baudrate
         self.timeout  = timeout
+        self.packing  = packing
+        self.base_baudrate = base_baudrate
+
+        # The FPGA is looked for in the background, so the window does not
+        # wait for it, and HW filters run in software until it is found
+        self.session  = None
+        self.connector = Thread(target = self.connect_session, daemon = True)
+        self.connector.start()
 
-        self.open_serial()
         self.create_layouts()
         self.create_widgets()
         self.setup_widgets()
@@ -38,18 +44,6 @@ class Gui(QWidget):
         self.t = Thread(target = self.progress_updater)
         self.t.start()
 
-    def open_serial(self):
-        try:
-            if hasattr(self, 'uart') and self.uart is not None:
-                self.uart.close()
-
-            self.uart = Uart(self.port, self.baudrate, self.timeout)
-
-        except Exception as e:
-            print(e)
-            self.uart = None
-            print("Hardware error: Failed to open serial port")
-
     def create_layouts(self):
         self.main_layout    = QVBoxLayout(self)
         self.plot_layout    = QHBoxLayout()
@@ -141,9 +135,22 @@ class Gui(QWidget):
         if a0.key() == Qt.Key.Key_Escape:
             self.alive = False
             self.t.join()
+            if self.session is not None:
+                self.session.close()
             self.close()
         return super().keyPressEvent(a0)
 
+    def connect_session(self):
+        self.session = Session(self.port, self.baudrate, self.timeout, self.RESPONSE_BYTES, self.packing, self.base_baudrate)
+
+    def hw_ready(self):
+        # A session that lost the FPGA, after a disconnect, looks for it again
+        if self.session is None:
+            print("Still looking for the FPGA")
+            return False
+
+        return self.session.healthy() or self.session.connect()
+
     def progress_updater(self):
         while self.alive:
             if self.pshow:
@@ -165,9 +172,10 @@ class Gui(QWidget):
         self.pshow = self.currfilt.hw
 
     def apply_filter(self):
+        # Filters never write into the image, and handing over the same one
+        # each time lets them keep what only depends on it (see ImAdjust)
         img = self.canvas.images[0]
         if img is not None:
-            img = img.copy()
             for filter in self.filters:
                 if filter.name == self.filter_options.currentText():
                     break
@@ -179,31 +187,39 @@ class Gui(QWidget):
             self.pvalue = 0
 
             if filter.hw:
+                if not filter.valid_size():
+                    print("Invalid kernel size")
+                    return
+
                 if len(img.shape) == 2:
                     img = img.reshape(*img.shape, 1)
 
-                res = []
-                img = (self.normalize(img) * 255).astype(np.uint8)
-                kernel = filter.get_kernel()
+                img = quantize(img)
+                kernel = filter.get_hw_kernel()
+                shift, output = filter.get_hw_scale()
 
                 print('Using kernel:')
                 print(kernel)
+                if shift:
+                    print('Scaled down by 2**{}'.format(shift))
 
-                for dim in range(img.shape[2]):
-                    r = self.hw_filter(img[:, :, dim], kernel)
-                    self.pvalue = int((dim + 1) / img.shape[2] * 100)
-                    if r is None:
-                        return
+                def progress(done, total):
+                    self.pvalue = int(done / total * 100)
 
-                    res.append(r)
-                    res[-1] = res[-1].reshape(*res[-1].shape, 1)
+                if self.hw_ready() and self.session.fits(img, kernel):
+                    res = self.hw_filter(img, kernel, progress, border = filter.get_border(), shift = shift, output = output)
+                    if res is None:
+                        return
 
-                res = np.concatenate(tuple(res), axis = -1).astype(float)
+                    if res.shape[2] == 1:
+                        res = res.reshape(res.shape[:2])
 
-                if res.shape[2] == 1:
-                    res = res.reshape(res.shape[:2])
+                    res = normalize(res)
 
-                res = self.normalize(res)
+                else:
+                    # Same results, without the FPGA
+                    print("Running {} in software".format(filter.name))
+                    res = filter.apply(img)
 
             else:
                 res = filter.apply(img)
@@ -228,59 +244,9 @@ class Gui(QWidget):
 
             imsave(filename, self.canvas.images[1], cmap = cmap)
 
-    def send_data(self, values, n):
-        ret = 0
-        for _v in values:
-            v = int(_v)
-            for i in range(n):
-                ret = self.uart.send((v >> (i << 3)) & 0xFF)
-                if ret != 0:
-                    raise IOError("Failed to connect with serial device")
-        return ret
-
-    @staticmethod
-    def normalize(img):
-        return (img - img.min()) / abs(img - img.min()).max()
-    
-    def hw_filter(self, img, kernel):
-        self.open_serial()
-
-        if self.uart is None:
-            return None
-
-        if img.shape[0] > self.MAX_IMG_HEIGHT or img.shape[1] > self.MAX_IMG_WIDTH:
-            print("Image is too big for hardware implementation")
-            return
-
+    def hw_filter(self, img, kernel, progress = None, out = None, border = BORDER_ZERO, shift = 0, output = OUTPUT_WRAP24):
         try:
-            if (
-                len(kernel.shape) != 2 or
-                kernel.shape[0] != kernel.shape[1] or
-                kernel.shape[0] > self.KERNEL_SIZE
-            ):
-                print("Wrong kernel format")
-                return
-            self.send_data([kernel.shape[0]], 1)
-            self.send_data(kernel.reshape(-1), 2)
-            self.send_data(img.shape, 2)
-            self.send_data(img.reshape(-1), 1)
-        except IOError:
-            self.uart = None
-            print("Serial port disconnected")
-            return
+            return self.session.run(img, kernel, progress, out, border, shift, output)
         except Exception as e:
             print(e)
             return
-
-        _res = self.uart.receive(len(img.reshape(-1)) * self.RESPONSE_BYTES)
-        if _res is not None:
-            res = []
-            for i in range(0, len(_res), self.RESPONSE_BYTES):
-                v = int.from_bytes(_res[i : i + self.RESPONSE_BYTES], 'little')
-                v -= (v & (1 << ((self.RESPONSE_BYTES << 3) - 1))) << 1
-                res.append(v)
-            res = np.reshape(res, img.shape)
-        else:
-            res = None
-
-        return res
\ No newline at end of file
@@ -0,0 +1,258 @@
+from amaranth import *
+from amaranth.sim import Simulator, Settle, Passive
+from dsp_fpga.tp_final.hdl.fifo import Fifo
+from dsp_fpga.tp_final.hdl.compression import Compressor, Decompressor
+from dsp_fpga.tp_final.hdl.kernel_filter import KernelFilter
+from dsp_fpga.tp_final.protocol import (
+    encode_frame, encode_kernel, encode_shape, encode_compress, encode_packed_pixels, decode_response, iter_packed_rows,
+    scale_responses, BORDER_ZERO, BORDER_REPLICATE, BORDER_MIRROR, PACK_PIXELS, PACK_RESPONSES,
+    OUTPUT_WRAP24, OUTPUT_SAT16, OUTPUT_SAT8, OUTPUT_UINT8, OUTPUTS,
+)
+import numpy as np
+import argparse
+import multiprocessing
+import time
+
+BORDERS = {
+    'zero'      : BORDER_ZERO,
+    'replicate' : BORDER_REPLICATE,
+    'mirror'    : BORDER_MIRROR,
+}
+
+OUTPUT_FORMATS = {
+    'wrap24'    : OUTPUT_WRAP24,
+    'sat16'     : OUTPUT_SAT16,
+    'sat8'      : OUTPUT_SAT8,
+    'uint8'     : OUTPUT_UINT8,
+}
+
+PADDING = {
+    BORDER_ZERO      : 'constant',
+    BORDER_REPLICATE : 'edge',
+    BORDER_MIRROR    : 'reflect',
+}
+
+def reference(img, kernel, border = BORDER_ZERO, width = 24, shift = 0, output = OUTPUT_WRAP24):
+    kernel  = np.asarray(kernel, dtype = np.int64)
+    padded  = np.pad(img.astype(np.int64), kernel.shape[0] // 2, mode = PADDING[border])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, kernel.shape)
+    res     = np.einsum('ijkl,kl->ij', windows, kernel[::-1, ::-1])
+
+    # KernelFilter accumulates in width bits, so the result wraps around
+    half = 1 << (width - 1)
+    return scale_responses(((res + half) & ((half << 1) - 1)) - half, shift, output)
+
+class Bench:
+    def __init__(self, w, kernel_size, macs = 1, chain = False, depth = 256):
+        self.m      = m = Module()
+        self.chain  = chain
+        self.kernel = kernel = KernelFilter(
+            w           = w,
+            kernel_size = kernel_size,
+            timeout     = 2**20,
+            macs        = macs,
+        )
+        m.submodules.kernel = kernel
+
+        if not chain:
+            self.sink   = kernel.sink
+            self.source = kernel.source
+            self.fifos  = {}
+            return
+
+        # Same chain as hdl/top.py, without the uart
+        m.submodules.rfifo   = rfifo   = Fifo(payload = [('data', 8)], depth = depth)
+        m.submodules.tfifo   = tfifo   = Fifo(payload = [('data', 8)], depth = depth)
+        m.submodules.decompressor = decompressor = Decompressor()
+        m.submodules.compressor   = compressor   = Compressor(width = len(kernel.source.data))
+
+        def connect(sink, source):
+            return [
+                source[v].eq(sink[v]) for v in sink.fields.keys() if v != 'ready'
+            ] + [sink.ready.eq(source.ready)]
+
+        m.d.comb += [
+            decompressor.enable.eq(kernel.unpack),
+
+            *connect(rfifo.source,        decompressor.sink),
+            *connect(decompressor.source, kernel.sink),
+            *connect(kernel.source,       compressor.sink),
+            *connect(compressor.source,   tfifo.sink),
+        ]
+
+        self.sink   = rfifo.sink
+        self.source = tfifo.source
+        self.fifos  = {'rfifo': rfifo, 'tfifo': tfifo}
+
+    # Runs until nout outputs came out of the chain, counted in bytes or, if
+    # packed, in groups of 7 bits
+    def run(self, payload, nout, ready = 1., seed = 0, maxcycles = 10**7, packed = False):
+        sim   = Simulator(self.m)
+        rng   = np.random.default_rng(seed)
+        out   = []
+        stats = {
+            'cycles'        : 0,
+            'input stalls'  : 0,
+            'output stalls' : 0,
+            **{name: [] for name in self.fifos},
+        }
+        sim.add_clock(1e-6)
+
+        def feed():
+            for byte in payload:
+                yield self.sink.data.eq(byte)
+                yield self.sink.valid.eq(1)
+                while True:
+                    yield Settle()
+                    accepted = yield self.sink.ready
+                    yield
+                    if accepted:
+                        break
+
+            yield self.sink.valid.eq(0)
+
+        def drain():
+            count = 0
+            while count < nout and stats['cycles'] < maxcycles:
+                yield self.source.ready.eq(int(rng.random() < ready))
+                yield Settle()
+                if (yield self.source.valid) and (yield self.source.ready):
+                    out.append((yield self.source.data))
+                    count += not packed or out[-1] < 0x80
+
+                yield
+                stats['cycles'] += 1
+
+        # The kernel is stalled on its input when it would take a pixel that
+        # has not arrived, and on its output when its result is not taken
+        def monitor():
+            yield Passive()
+            kernel = self.kernel
+            while True:
+                yield Settle()
+                if (yield kernel.sink.ready) and not (yield kernel.sink.valid):
+                    stats['input stalls'] += 1
+                if (yield kernel.source.valid) and not (yield kernel.source.ready):
+                    stats['output stalls'] += 1
+                for name, fifo in self.fifos.items():
+                    stats[name].append((yield fifo.level))
+                yield
+
+        sim.add_sync_process(feed)
+        sim.add_sync_process(drain)
+        sim.add_sync_process(monitor)
+        sim.run()
+
+        if self.chain:
+            return bytes(out), stats
+
+        return np.array(out, dtype = np.int64), stats
+
+def report(name, ok, pixels, stats):
+    print('{}: {}'.format(name, 'ok' if ok else 'MISMATCH'))
+    print('    {} cycles, {:.2f} cycles per pixel'.format(stats['cycles'], stats['cycles'] / pixels))
+    print('    stalled {} cycles on input, {} cycles on output'.format(stats['input stalls'], stats['output stalls']))
+    for fifo in ('rfifo', 'tfifo'):
+        if stats.get(fifo):
+            level = np.array(stats[fifo])
+            print('    {} occupancy max {} mean {:.1f}'.format(fifo, level.max(), level.mean()))
+
+def elaborate(w, kernel_size, macs):
+    from amaranth.back import rtlil
+
+    kernel = KernelFilter(w = w, kernel_size = kernel_size, timeout = 2**20, macs = macs)
+    rtlil.convert(kernel, ports = [
+        *kernel.sink.fields.values(), *kernel.source.fields.values(),
+        kernel.resync, kernel.unpack, kernel.divisor, kernel.switch,
+    ])
+
+# Converts the filter to RTLIL in another process, given up on after limit
+# seconds, as synthesis would take it
+def check_elaboration(w, kernel_size, macs, limit):
+    start = time.perf_counter()
+    proc  = multiprocessing.Process(target = elaborate, args = (w, kernel_size, macs))
+    proc.start()
+    proc.join(limit)
+    if proc.is_alive():
+        proc.terminate()
+        proc.join()
+
+    elapsed = time.perf_counter() - start
+    ok      = proc.exitcode == 0
+    print('elaboration of kernel_size={} with {} MACs: {}'.format(kernel_size, macs, 'ok' if ok else 'FAILED'))
+    print('    {:.1f} s{}'.format(elapsed, '' if ok or elapsed < limit else ', over the {} s limit'.format(limit)))
+    return ok
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--height', required = False, type = int, default = 16)
+    parser.add_argument('--width', required = False, type = int, default = 16)
+    parser.add_argument('--frames', required = False, type = int, default = 1)
+    parser.add_argument('--size', required = False, type = int, default = 5)
+    parser.add_argument('--kernel-size', required = False, type = int, default = 11)
+    parser.add_argument('--macs', required = False, type = int, nargs = '+', default = [1])
+    parser.add_argument('--border', required = False, choices = BORDERS.keys(), default = 'zero')
+    parser.add_argument('--separable', required = False, action = 'store_true', default = False)
+    parser.add_argument('--chain', required = False, action = 'store_true', default = False)
+    parser.add_argument('--pack', required = False, action = 'store_true', default = False)
+    parser.add_argument('--shift', required = False, type = int, default = 0)
+    parser.add_argument('--output', required = False, choices = OUTPUT_FORMATS.keys(), default = 'wrap24')
+    parser.add_argument('--ready', required = False, type = float, default = 1.)
+    parser.add_argument('--seed', required = False, type = int, default = 0)
+    parser.add_argument('--elaborate', required = False, action = 'store_true', default = False)
+    parser.add_argument('--time-limit', required = False, type = float, default = 60.)
+    args = parser.parse_args()
+
+    # Every configuration must elaborate in time before it is simulated, with
+    # --elaborate nothing else is done
+    for macs in args.macs:
+        if not check_elaboration(args.width, args.kernel_size, macs, args.time_limit):
+            raise SystemExit(1)
+
+    if args.elaborate:
+        raise SystemExit(0)
+
+    rng    = np.random.default_rng(args.seed)
+    border = BORDERS[args.border]
+    output = OUTPUT_FORMATS[args.output]
+    nbytes, signed = OUTPUTS[output]
+    imgs   = rng.integers(0, 256, (args.frames, args.height, args.width), dtype = np.uint8)
+
+    if args.separable:
+        col    = rng.integers(-128, 128, args.size)
+        row    = rng.integers(-128, 128, args.size)
+        sent   = (col, row)
+        kernel = np.outer(col, row)
+    else:
+        kernel = rng.integers(-128, 128, (args.size, args.size))
+        sent   = kernel
+
+    # Every frame after the first one reuses the kernel already uploaded
+    if args.pack:
+        payload = encode_compress(PACK_PIXELS | PACK_RESPONSES) + b''.join(
+            encode_kernel(sent if not i else None, border, args.shift, output) + encode_shape(img.shape) + encode_packed_pixels(img)[0]
+            for i, img in enumerate(imgs)
+        )
+    else:
+        payload = b''.join(
+            encode_frame(sent if not i else None, img, border, args.shift, output) for i, img in enumerate(imgs)
+        )
+    ref     = np.concatenate([reference(img, kernel, border, shift = args.shift, output = output).reshape(-1) for img in imgs])
+
+    for macs in args.macs:
+        bench = Bench(args.width, args.kernel_size, macs = macs, chain = args.chain or args.pack)
+        nout  = ref.size * (1 if args.pack or not args.chain else nbytes)
+        res, stats = bench.run(payload, nout, ready = args.ready, seed = args.seed, packed = args.pack)
+
+        if args.pack:
+            print('    {} bytes in, {} bytes out'.format(len(payload), len(res)))
+            res = np.concatenate([rows.reshape(-1) for _, rows in iter_packed_rows([res], args.width, args.height)])
+        elif args.chain:
+            res = decode_response(res, nbytes, signed)
+
+        name = '{} frame(s) of {}x{}, k={}{} on kernel_size={} with {} MACs, {} border'.format(
+            args.frames, args.height, args.width, args.size, ' separable' if args.separable else '',
+            args.kernel_size, macs, args.border,
+        )
+        report(name, len(res) == len(ref) and (res == ref).all(), ref.size, stats)
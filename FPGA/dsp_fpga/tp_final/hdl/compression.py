@@ -0,0 +1,144 @@
+from amaranth import *
+from math import ceil
+
+class Decompressor(Elaboratable):
+
+    # While enabled, the sink carries packets of pixel differences. A header
+    # byte with bit 7 set is followed by one difference applied count times,
+    # and otherwise by count differences, with count given by bits 0 to 6
+    # plus one. Bytes pass through untouched while disabled.
+    RUN = 0x80
+
+    def __init__(self, domain = 'sync'):
+        self.sink   = Record([('data', 8), ('valid', 1), ('ready', 1)])
+        self.source = Record([('data', 8), ('valid', 1), ('ready', 1)])
+        self.enable = Signal()
+        self.domain = domain
+
+    def elaborate(self, platform):
+        m = Module()
+        sync = m.d[self.domain]
+
+        prev  = Signal(8)
+        delta = Signal(8)
+        count = Signal(7)
+        run   = Signal()
+
+        # Headers are only taken when a pixel is wanted, so that nothing past
+        # the last packet of a frame is read
+        with m.FSM(reset = 'HEADER', domain = self.domain) as fsm:
+            with m.State('HEADER'):
+                m.d.comb += self.sink.ready.eq(self.source.ready)
+                with m.If(self.sink.valid & self.source.ready):
+                    sync += [
+                        count   .eq(self.sink.data[:7]),
+                        run     .eq((self.sink.data & self.RUN) != 0),
+                    ]
+                    with m.If((self.sink.data & self.RUN) != 0):
+                        m.next = 'DELTA'
+                    with m.Else():
+                        m.next = 'DATA'
+
+            with m.State('DELTA'):
+                m.d.comb += self.sink.ready.eq(self.source.ready)
+                with m.If(self.sink.valid & self.source.ready):
+                    sync += delta.eq(self.sink.data)
+                    m.next = 'DATA'
+
+            with m.State('DATA'):
+                with m.If(run):
+                    m.d.comb += [
+                        self.source.valid   .eq(1),
+                        self.source.data    .eq(prev + delta),
+                    ]
+                with m.Else():
+                    m.d.comb += [
+                        self.source.valid   .eq(self.sink.valid),
+                        self.source.data    .eq(prev + self.sink.data),
+                        self.sink.ready     .eq(self.source.ready),
+                    ]
+
+                with m.If(self.source.valid & self.source.ready):
+                    sync += [
+                        prev    .eq(self.source.data),
+                        count   .eq(count - 1),
+                    ]
+                    with m.If(count == 0):
+                        m.next = 'HEADER'
+
+        with m.If(~self.enable):
+            m.d.comb += [
+                self.source.valid   .eq(self.sink.valid),
+                self.source.data    .eq(self.sink.data),
+                self.sink.ready     .eq(self.source.ready),
+            ]
+            sync += [
+                fsm.state   .eq(fsm.encoding['HEADER']),
+                prev        .eq(0),
+            ]
+
+        return m
+
+
+class Compressor(Elaboratable):
+
+    # Sends the nbytes low bytes of each word, lowest first. Packed words go
+    # as their difference to the last packed one, or to zero if first,
+    # zigzag encoded in groups of 7 bits, bit 7 set on all but the last.
+    def __init__(self, width, domain = 'sync'):
+        self.width  = width
+        self.domain = domain
+
+        self.sink   = Record([
+            ('data', width), ('nbytes', ceil(width / 8).bit_length()), ('first', 1), ('pack', 1), ('valid', 1), ('ready', 1),
+        ])
+        self.source = Record([('data', 8), ('valid', 1), ('ready', 1)])
+
+    def elaborate(self, platform):
+        m = Module()
+        sync = m.d[self.domain]
+
+        nbytes  = ceil(self.width / 8)
+        ngroups = ceil(self.width / 7)
+
+        prev    = Signal(self.width)
+        delta   = Signal(self.width)
+        zigzag  = Signal(self.width)
+        length  = Signal(range(ngroups + 1))
+        buf     = Signal(8 * max(nbytes, ngroups))
+        left    = Signal(range(max(nbytes, ngroups) + 1))
+
+        groups  = [zigzag[7 * i : 7 * (i + 1)] for i in range(ngroups)]
+        more    = [zigzag[7 * (i + 1):].any() for i in range(ngroups - 1)] + [Const(0, 1)]
+        varint  = Cat(*[Cat(group, Const(0, 7 - len(group)), more[i]) for i, group in enumerate(groups)])
+
+        m.d.comb += [
+            delta   .eq(self.sink.data - Mux(self.sink.first, 0, prev)),
+            zigzag  .eq(Cat(Const(0, 1), delta[:-1]) ^ Repl(delta[-1], self.width)),
+            length  .eq(1 + sum(more[i] for i in range(ngroups - 1))),
+
+            self.source.data    .eq(buf[:8]),
+            self.source.valid   .eq(left != 0),
+            self.sink.ready     .eq((left == 0) | ((left == 1) & self.source.ready)),
+        ]
+
+        with m.If(self.source.valid & self.source.ready):
+            sync += [
+                buf     .eq(buf >> 8),
+                left    .eq(left - 1),
+            ]
+
+        with m.If(self.sink.valid & self.sink.ready):
+            with m.If(self.sink.pack):
+                sync += [
+                    buf     .eq(varint),
+                    left    .eq(length),
+                    prev    .eq(self.sink.data),
+                ]
+            with m.Else():
+                sync += [
+                    buf     .eq(self.sink.data),
+                    left    .eq(self.sink.nbytes),
+                ]
+
+        return m
@@ -1,75 +1,345 @@
 from amaranth import *
+from math import ceil
+
+def adder_tree(terms):
+    while len(terms) > 1:
+        terms = [a + b for a, b in zip(terms[::2], terms[1::2])] + terms[len(terms) & ~1:]
+    return terms[0]
 
 class KernelFilter(Elaboratable):
-    def __init__(self, h, w, kernel_size, timeout, domain = 'sync'):
-        self.h = h
+
+    # Sent instead of the kernel size to filter with the last uploaded kernel
+    REUSE_KERNEL = 0xFF
+    # Sent instead of the kernel size, followed by a new uart divisor
+    BAUD         = 0xFE
+    # Sent instead of the kernel size, followed by the PACK flags for the
+    # frames to come
+    COMPRESS     = 0xFD
+    PACK_PIXELS    = 0x1
+    PACK_RESPONSES = 0x2
+    # Set in the kernel size when the kernel comes as a column and a row
+    SEPARABLE    = 0x80
+    # Kernel size bits selecting how pixels beyond the image borders are taken
+    BORDER       = 0x60
+
+    BORDER_ZERO      = 0
+    BORDER_REPLICATE = 1
+    BORDER_MIRROR    = 2
+
+    # The kernel size of every upload is followed by a byte with the rounding
+    # right shift of the outputs in bits 0 to 4, and how they are sent in
+    # bits 5 and 6, in 24 bits wrapping around or saturated to fewer bits
+    OUTPUT_WRAP24 = 0
+    OUTPUT_SAT16  = 1
+    OUTPUT_SAT8   = 2
+    OUTPUT_UINT8  = 3
+
+    def __init__(self, w, kernel_size, timeout, macs = 1, domain = 'sync'):
         self.w = w
         self.kernel_size = kernel_size
         self.timeout = timeout
+        self.macs    = macs
         self.domain  = domain
 
-        assert h < 2**16 - kernel_size//2, "Maximum image size excedeed"
         assert w < 2**16 - kernel_size//2, "Maximum image size excedeed"
         assert kernel_size%2, "Kernel size must be odd"
+        assert kernel_size < 0x20, "Maximum kernel size excedeed"
+        assert 0 < macs <= kernel_size**2, "Invalid number of multipliers"
 
+        # Along with every output goes the number of bytes it takes unpacked
         self.sink   = Record([('data', 8), ('valid', 1), ('ready', 1)])
-        self.source = Record([('data', signed(24)), ('valid', 1), ('ready', 1)])
+        self.source = Record([
+            ('data', signed(24)), ('nbytes', 2), ('first', 1), ('pack', 1), ('valid', 1), ('ready', 1),
+        ])
+        self.resync = Signal()
+
+        # Raised while the sink carries packed pixels, see hdl/compression.py
+        self.unpack = Signal()
+
+        # Raised for a cycle along with the acknowledge of a BAUD command
+        self.divisor = Signal(32)
+        self.switch  = Signal()
 
     def elaborate(self, platform):
         m = Module()
         sync = m.d[self.domain]
 
-        maxh  = self.h + (self.kernel_size - 1)
-        maxw  = self.w + (self.kernel_size - 1)
-        halfk = self.kernel_size // 2
-
-        mem = Memory(width = 8, depth = maxh * maxw)
-        m.submodules.mrp = mrp = mem.read_port(domain = self.domain)
-        m.submodules.mwp = mwp = mem.write_port(domain = self.domain)
-
-        memk = Memory(width = 16, depth = self.kernel_size**2)
-        m.submodules.krp = krp = memk.read_port(domain = self.domain)
-        m.submodules.kwp = kwp = memk.write_port(domain = self.domain)
-        # kernel    = Array([Signal(signed(16), name = f'k{i}') for i in range(self.kernel_size**2)])
-
-        addr      = Signal(range(self.kernel_size**2))
+        maxh   = 2**16 + self.kernel_size
+        maxw   = self.w
+        halfk  = self.kernel_size // 2
+        ntaps  = self.kernel_size**2
+        groups = ceil(ntaps / self.macs)
+        kgroups = ceil(self.kernel_size / self.macs)
+
+        # The image is streamed as is, row after row. The line buffers keep the
+        # last kernel_size - 1 rows and the window the last kernel_size columns,
+        # which hold the neighbourhood of the pixel halfk rows and columns behind
+        # the newest one. Taps falling beyond the image borders are taken from
+        # other pixels of the window, so no padding is ever streamed.
+        lrps = []
+        lwps = []
+        for i in range(self.kernel_size - 1):
+            line = Memory(width = 8, depth = maxw)
+            m.submodules[f'lrp{i}'] = lrp = line.read_port(domain = self.domain)
+            m.submodules[f'lwp{i}'] = lwp = line.write_port(domain = self.domain)
+            lrps.append(lrp)
+            lwps.append(lwp)
+
+        win    = [Signal(8, name = f'w{i}') for i in range(ntaps)]
+        coefs  = [Signal(signed(16), name = f'k{i}') for i in range(ntaps)]
+        kernel = Array(coefs)
+
+        # A separable kernel is applied as a column pass over the newest column
+        # of the window, whose sums are kept for the last kernel_size columns,
+        # and a row pass over those sums.
+        vcoefs  = [Signal(signed(16), name = f'v{i}') for i in range(self.kernel_size)]
+        hcoefs  = [Signal(signed(16), name = f'h{i}') for i in range(self.kernel_size)]
+        vkernel = Array(vcoefs)
+        hkernel = Array(hcoefs)
+        csums   = [Signal(signed(len(self.source.data)), name = f'c{i}') for i in range(self.kernel_size)]
+
+        addr      = Signal(range(max(ntaps, groups)))
         curr      = Signal(signed(len(self.source.data)))
         high      = Signal()
+        busy      = Signal()
+        sep       = Signal()
+        phase     = Signal()
+        emit      = Signal()
+        first     = Signal()
+        load      = Signal()
+        last      = Signal()
+        outside   = Signal()
+        border    = Signal(2)
+        packing   = Signal(2)
+        scale     = Signal(7)
+        rounded   = Signal(signed(26))
+        scaled    = Signal(signed(26))
+        result    = Signal(signed(24))
+        nbytes    = Signal(2)
         cntr      = Signal(range(self.timeout))
 
         row       = Signal(range(maxh))
         col       = Signal(range(maxw))
+        nxtcol    = Signal(range(maxw))
+        orow      = Signal(range(maxh))
+        ocol      = Signal(range(maxw))
+        lead      = Signal(range(halfk * maxw + halfk + 1))
         krow      = Signal(range(self.kernel_size))
         kcol      = Signal(range(self.kernel_size))
-        nxtrow    = Signal(range(maxh))
-        nxtcol    = Signal(range(maxw))
-        watchrow  = Signal(range(maxh))
-        watchol   = Signal(range(maxw))
-        nxt_mrp   = Signal(range(maxh * maxw))
         madd      = Signal(signed(len(self.source.data)))
-
-        h         = Signal(range(maxh))
-        w         = Signal(range(maxw))
+        pix       = Signal(8)
+        virtual   = Signal()
+        shift     = Signal()
+        due       = Signal()
+        done      = Signal()
+        advance   = Signal()
+        column    = [lrp.data for lrp in lrps] + [pix]
+
+        size      = Signal(32)
+        h         = Signal(16)
+        w         = Signal(range(maxw + 1))
         k         = Signal(range(self.kernel_size))
         currk     = Signal(8)
 
+        # Maps each offset of the window around position p of a line of n pixels
+        # to the offset of the pixel standing in for it, or flags it as zero
+        def remap(p, n):
+            sels  = []
+            zeros = []
+            for d in range(-halfk, halfk + 1):
+                idx = Signal(signed(len(p) + 2))
+                tgt = Signal(signed(len(p) + 2))
+                sel = Signal(range(self.kernel_size))
+
+                def clamp(x):
+                    return Mux(x < 0, 0, Mux(x >= n, n - 1, x))
+
+                m.d.comb += [
+                    idx.eq(p + d),
+                    tgt.eq(Mux(border == self.BORDER_MIRROR,
+                        clamp(Mux(idx < 0, -idx, Mux(idx >= n, 2*n - 2 - idx, idx))),
+                        Mux(border == self.BORDER_REPLICATE, clamp(idx), idx),
+                    )),
+                    sel.eq(tgt - p + halfk),
+                ]
+                sels.append(sel)
+                zeros.append((border == self.BORDER_ZERO) & ((idx < 0) | (idx >= n)))
+
+            return sels, zeros
+
+        # A pixel stands in for offset d from at most |d| offsets away, so
+        # only the edge rows and columns need a mux, the center one none
+        def pick(values, sel, d):
+            if d == 0:
+                return values[halfk]
+            lo = halfk - abs(d)
+            return Array(values[lo : self.kernel_size - lo])[sel - lo]
+
+        # Outputs go down a pipeline that moves whenever the filter is free
+        # to take the next one. The selects of every row and column are set as
+        # the pixel enters the window, the rows are remapped on the next step
+        # and the columns on the one after, while the window goes on shifting.
+        # The separable column pass only needs the rows, and the row pass the
+        # sums, remapped once the column pass is done.
+        vsel   = [Signal(range(self.kernel_size), name = f'vs{i}') for i in range(self.kernel_size)]
+        vzero  = Signal(self.kernel_size)
+        hsel   = [[Signal(range(self.kernel_size), name = f'hs{s}_{i}') for i in range(self.kernel_size)] for s in range(3)]
+        hzero  = [Signal(self.kernel_size, name = f'hz{s}') for s in range(3)]
+        valid  = [Signal(name = f'valid{s}') for s in range(2)]
+        emits  = [Signal(name = f'emit{s}') for s in range(2)]
+        firsts = [Signal(name = f'first{s}') for s in range(2)]
+        rows   = [[Signal(8, name = f'r{i}_{j}') for j in range(self.kernel_size)] for i in range(self.kernel_size)]
+        taps   = [Signal(8, name = f't{i}') for i in range(ntaps)]
+        newc   = [Signal(8, name = f'n{i}') for i in range(self.kernel_size)]
+        sums   = [Signal(signed(len(self.source.data)), name = f's{i}') for i in range(self.kernel_size)]
+
+        vnext, vnzero = remap(Mux(sep, row - halfk, orow), h)
+        hnext, hnzero = remap(ocol, w)
+
+        # Each cycle multiplies a group of macs taps of the window, padded with
+        # zero taps, and sums the products with an adder tree. With a single
+        # group the whole window is filtered in one cycle.
+        def operands(values, n, zero):
+            return Array([values[t] if t < n else zero for t in lane])
+
+        products = []
+        for j in range(self.macs):
+            lane = range(j, groups * self.macs, self.macs)
+            coef = Mux(sep,
+                Mux(phase,
+                    operands(hcoefs, self.kernel_size, Const(0, signed(16)))[addr],
+                    operands(vcoefs, self.kernel_size, Const(0, signed(16)))[addr],
+                ),
+                operands(coefs, ntaps, Const(0, signed(16)))[addr],
+            )
+            data = Mux(sep,
+                Mux(phase,
+                    operands(sums, self.kernel_size, Const(0, signed(len(self.source.data))))[addr],
+                    operands(newc, self.kernel_size, Const(0, 8))[addr],
+                ),
+                operands(taps, ntaps, Const(0, 8))[addr],
+            )
+            products.append(coef * data)
+
         m.d.comb  += [
-            nxtrow      .eq(Mux(col >= w - 1, row + 1, row)),
-            nxtcol      .eq(Mux(col >= w - 1, 0, col + 1)),
-            watchrow    .eq(row + krow - halfk),
-            watchol     .eq(col + kcol + 1 - halfk),
-            nxt_mrp     .eq((nxtrow - halfk)*w + (nxtcol - halfk)),
-            # madd        .eq(curr + kernel[addr] * Cat(mrp.data, Const(0, 8))),
-            madd        .eq(curr + krp.data.as_signed() * Cat(mrp.data, Const(0, 8))),
-        ]
-        sync      += [
-            kwp.en      .eq(0),
-            kwp.addr    .eq(0),
+            self.divisor.eq(size),
+            madd        .eq(curr + adder_tree(products)),
+            last        .eq(addr == Mux(sep, kgroups - 1, groups - 1)),
+            virtual     .eq(row >= h),
+            nxtcol      .eq(Mux(col < w - 1, col + 1, 0)),
+            pix         .eq(Mux(virtual, 0, self.sink.data)),
+            *[lrp.addr  .eq(Mux(shift, nxtcol, col)) for lrp in lrps],
+            *[lwp.addr  .eq(col) for lwp in lwps],
+            *[lwp.data  .eq(column[i + 1]) for i, lwp in enumerate(lwps)],
+            *[lwp.en    .eq(shift) for lwp in lwps],
+
+            rounded     .eq(madd + (Const(1, 25) << scale[:5])[1:25]),
+            scaled      .eq(rounded >> scale[:5]),
         ]
 
+        def saturate(lo, hi):
+            return Mux(scaled < lo, lo, Mux(scaled > hi, hi, scaled))
+
+        with m.Switch(scale[5:]):
+            with m.Case(self.OUTPUT_WRAP24):
+                m.d.comb += result.eq(scaled[:24]), nbytes.eq(3)
+            with m.Case(self.OUTPUT_SAT16):
+                m.d.comb += result.eq(saturate(-2**15, 2**15 - 1)), nbytes.eq(2)
+            with m.Case(self.OUTPUT_SAT8):
+                m.d.comb += result.eq(saturate(-2**7, 2**7 - 1)), nbytes.eq(1)
+            with m.Case(self.OUTPUT_UINT8):
+                m.d.comb += result.eq(saturate(0, 2**8 - 1)), nbytes.eq(1)
+
         with m.If(self.source.ready):
             sync += self.source.valid.eq(0)
 
+        # The last step of the pipeline is held while its output is being
+        # computed, and released on the cycle the output is handed to the
+        # source.
+        with m.If(busy & load):
+            sync += load.eq(0)
+            sync += [
+                sums[j].eq(Mux(hzero[2][j], 0, pick(csums, hsel[2][j], j - halfk)))
+                for j in range(self.kernel_size)
+            ]
+
+        with m.Elif(busy):
+            with m.If(~last):
+                sync += [
+                    addr.eq(addr + 1),
+                    curr.eq(madd),
+                ]
+
+            with m.Elif(sep & ~phase):
+                sync += [csums[i].eq(csums[i + 1]) for i in range(self.kernel_size - 1)]
+                sync += csums[-1].eq(madd)
+                with m.If(emit):
+                    sync += [
+                        phase   .eq(1),
+                        addr    .eq(0),
+                        curr    .eq(0),
+                        load    .eq(1),
+                    ]
+                with m.Else():
+                    m.d.comb += done.eq(1)
+                    sync += busy.eq(0)
+
+            with m.Elif(~self.source.valid | self.source.ready):
+                m.d.comb += done.eq(1)
+                sync += [
+                    busy                .eq(0),
+                    self.source.valid   .eq(1),
+                    self.source.data    .eq(result),
+                    self.source.nbytes  .eq(nbytes),
+                    self.source.first   .eq(first),
+                    self.source.pack    .eq((packing & self.PACK_RESPONSES) != 0),
+                ]
+
+        m.d.comb += [
+            advance .eq(~busy | done),
+            due     .eq((lead == 0) | (sep & (row >= halfk))),
+        ]
+
+        with m.If(advance):
+            sync += [
+                valid[0]    .eq(shift & due),
+                emits[0]    .eq(lead == 0),
+                firsts[0]   .eq((lead == 0) & (orow == 0) & (ocol == 0)),
+                vzero       .eq(Cat(*vnzero)),
+                hzero[0]    .eq(Cat(*hnzero)),
+                *[sel.eq(nxt) for sel, nxt in zip(vsel + hsel[0], vnext + hnext)],
+            ]
+            sync += [
+                valid[1]    .eq(valid[0]),
+                emits[1]    .eq(emits[0]),
+                firsts[1]   .eq(firsts[0]),
+                hzero[1]    .eq(hzero[0]),
+                *[sel.eq(prv) for sel, prv in zip(hsel[1], hsel[0])],
+                *[
+                    rows[i][j].eq(Mux(vzero[i], 0, pick(win[j :: self.kernel_size], vsel[i], i - halfk)))
+                    for i in range(self.kernel_size) for j in range(self.kernel_size)
+                ],
+            ]
+            sync += [
+                busy        .eq(valid[1]),
+                emit        .eq(emits[1]),
+                first       .eq(firsts[1]),
+                hzero[2]    .eq(hzero[1]),
+                *[sel.eq(prv) for sel, prv in zip(hsel[2], hsel[1])],
+                *[newc[i].eq(rows[i][-1]) for i in range(self.kernel_size)],
+                *[
+                    taps[i * self.kernel_size + j].eq(Mux(hzero[1][j], 0, pick(rows[i], hsel[1][j], j - halfk)))
+                    for i in range(self.kernel_size) for j in range(self.kernel_size)
+                ],
+            ]
+            with m.If(valid[1]):
+                sync += [
+                    phase   .eq(0),
+                    addr    .eq(0),
+                    curr    .eq(0),
+                    load    .eq(0),
+                ]
+
         def check_timeout():
             sync = m.d[self.domain]
             with m.If(cntr >= self.timeout - 1):
@@ -83,75 +353,96 @@ class KernelFilter(Elaboratable):
             with m.Else():
                 sync += col.eq(0), row.eq(row + 1)
 
-        def iter_filter():
-            with m.If((row == h - 1) & (col == w - 1)):
-                m.next = 'KERNEL'
+        # The kernel is centered in the kernel_size grid and stored reversed, so
+        # that the filter is a convolution. A separable kernel takes two rows
+        # of the grid, the column first.
+        def store(value):
+            sync = m.d[self.domain]
+            sync += addr.eq(addr + 1)
+            with m.If(~sep):
+                sync += kernel[ntaps - addr - 1].eq(value)
+            with m.Elif(krow == 0):
+                sync += vkernel[self.kernel_size - kcol - 1].eq(value)
             with m.Else():
-                m.d.comb += mrp.addr.eq(nxt_mrp)
-                iter_colrow(col, row, w)
+                sync += hkernel[self.kernel_size - kcol - 1].eq(value)
+
+            iter_colrow(kcol, krow, self.kernel_size)
+            with m.If(Mux(sep, (krow == 1) & (kcol == self.kernel_size - 1), addr >= ntaps - 1)):
+                m.next = 'SIZE'
+                sync += addr.eq(0), kcol.eq(0), krow.eq(0)
 
-        with m.FSM(reset = 'KERNEL', domain = self.domain):
+        m.d.comb += outside.eq(
+            (~sep & (krow < (self.kernel_size - k)[1:])) |
+            (~sep & (krow >= (k + self.kernel_size)[1:])) |
+            (kcol < (self.kernel_size - k)[1:]) |
+            (kcol >= (k + self.kernel_size)[1:])
+        )
+
+        with m.FSM(reset = 'KERNEL', domain = self.domain) as fsm:
             with m.State('KERNEL'):
                 m.d.comb += self.sink.ready.eq(1)
                 sync += [
                     row      .eq(0),
                     col      .eq(0),
+                    orow     .eq(0),
+                    ocol     .eq(0),
                     krow     .eq(0),
                     kcol     .eq(0),
-                    mwp.addr .eq(0),
                     cntr     .eq(0),
                     addr     .eq(0),
                     high     .eq(0),
                 ]
+                with m.If(self.sink.valid):
+                    with m.If(self.sink.data == self.REUSE_KERNEL):
+                        m.next = 'SIZE'
+                    with m.Elif(self.sink.data == self.BAUD):
+                        m.next = 'BAUD'
+                    with m.Elif(self.sink.data == self.COMPRESS):
+                        m.next = 'COMPRESS'
+                    # Any other command is ignored
+                    with m.Elif((self.sink.data & self.BORDER) == self.BORDER):
+                        pass
+                    with m.Else():
+                        sync += [
+                            k       .eq(self.sink.data[:5] | Const(1, 1)),
+                            border  .eq(self.sink.data[5:7]),
+                            sep     .eq((self.sink.data & self.SEPARABLE) != 0),
+                        ]
+                        m.next = 'SCALE'
 
+            with m.State('SCALE'):
+                m.d.comb += self.sink.ready.eq(1)
                 with m.If(self.sink.valid):
-                    sync += k.eq(self.sink.data | Const(1, 1))
+                    sync += [
+                        scale   .eq(self.sink.data),
+                        cntr    .eq(0),
+                    ]
                     m.next = 'LOAD'
+
+                with m.Else():
+                    sync += cntr.eq(cntr + 1)
+
+                check_timeout()
             
             with m.State('LOAD'):
                 m.next = 'COEFS'
 
             with m.State('COEFS'):
-                with m.If(
-                    (krow < (self.kernel_size - k)[1:]) |
-                    (krow >= (k + self.kernel_size)[1:]) |
-                    (kcol < (self.kernel_size - k)[1:]) |
-                    (kcol >= (k + self.kernel_size)[1:])
-                ):
-                    sync += [
-                        high        .eq(0),
-                        addr        .eq(addr + 1),
-                        kwp.en      .eq(1),
-                        kwp.addr.eq(self.kernel_size**2 - addr - 1),
-                        kwp.data    .eq(0),
-                    ]
-                    iter_colrow(kcol, krow, self.kernel_size)
-                    with m.If(addr >= self.kernel_size**2 - 1):
-                        m.next = 'SIZE'
-                        sync += addr.eq(0), kcol.eq(0), krow.eq(0)
+                with m.If(outside):
+                    sync += high.eq(0)
+                    store(0)
 
                 with m.Else():
                     m.d.comb += self.sink.ready.eq(1)
                     with m.If(self.sink.valid):
                         sync += [
-                            addr.eq(addr + high),
                             high.eq(~high),
                             cntr.eq(0),
                         ]
                         with m.If(high):
-                            sync += [
-                                kwp.en.eq(1),
-                                kwp.addr.eq(self.kernel_size**2 - addr - 1),
-                                kwp.data.eq(Cat(currk, self.sink.data)),
-                            ]
+                            store(Cat(currk, self.sink.data))
                         with m.Else():
                             sync += currk.eq(self.sink.data)
-
-                        with m.If(high):
-                            iter_colrow(kcol, krow, self.kernel_size)
-                            with m.If(addr >= self.kernel_size**2 - 1):
-                                m.next = 'SIZE'
-                                sync += addr.eq(0), kcol.eq(0), krow.eq(0)
                 
                     with m.Else():
                         sync += cntr.eq(cntr + 1)
@@ -163,106 +454,129 @@ class KernelFilter(Elaboratable):
                 with m.If(self.sink.valid):
                     sync += [
                         addr.eq(addr + 1),
-                        Cat(h, Signal(16-len(h)), w, Signal(16-len(w))).word_select(addr[:2], 8).eq(self.sink.data),
+                        size.word_select(addr[:2], 8).eq(self.sink.data),
                         cntr.eq(0),
                     ]
                     with m.If(addr == 3):
                         sync += addr.eq(0)
-                        m.next = 'PAD'
+                        m.next = 'START'
                 
                 with m.Else():
                     sync += cntr.eq(cntr + 1)
                 
                 check_timeout()
 
-            with m.State('PAD'):
-                sync += [
-                    h.eq(h + (self.kernel_size - 1)),
-                    w.eq(w + (self.kernel_size - 1)),
-                ]
-                m.next = 'IMAGE'
-
-            with m.State('IMAGE'):
-                with m.If(
-                    (row < halfk) |
-                    (row >= h - halfk) |
-                    (col < halfk) |
-                    (col >= w - halfk)
-                ):
-                    m.d.comb += [
-                        mwp.en  .eq(1),
-                        mwp.data.eq(0),
+            with m.State('BAUD'):
+                m.d.comb += self.sink.ready.eq(1)
+                with m.If(self.sink.valid):
+                    sync += [
+                        addr.eq(addr + 1),
+                        size.word_select(addr[:2], 8).eq(self.sink.data),
+                        cntr.eq(0),
                     ]
-                    with m.If(mwp.addr >= h * w - 1):
-                        m.next = 'FILTER'
-                        sync += mwp.addr.eq(0), col.eq(0), row.eq(0)
-                    with m.Else():
-                        sync += mwp.addr.eq(mwp.addr + 1)
-                        iter_colrow(col, row, w)
+                    with m.If(addr == 3):
+                        sync += addr.eq(0)
+                        m.next = 'ACK'
 
                 with m.Else():
-                    m.d.comb += self.sink.ready.eq(1)
-                    with m.If(self.sink.valid):
-                        m.d.comb += [
-                            mwp.en  .eq(1),
-                            mwp.data.eq(self.sink.data),
-                        ]
-                        sync += [
-                            cntr.eq(0),
-                            mwp.addr.eq(mwp.addr + 1),
-                        ]
-                        iter_colrow(col, row, w)
+                    sync += cntr.eq(cntr + 1)
 
-                    with m.Else():
-                        sync += cntr.eq(cntr + 1)
+                check_timeout()
 
-                    check_timeout()
+            # The divisor is echoed back before the uart switches to it
+            with m.State('ACK'):
+                with m.If(~self.source.valid | self.source.ready):
+                    m.d.comb += self.switch.eq(1)
+                    sync += [
+                        self.source.valid   .eq(1),
+                        self.source.data    .eq(size),
+                        self.source.nbytes  .eq(3),
+                        self.source.first   .eq(0),
+                        self.source.pack    .eq(0),
+                    ]
+                    m.next = 'KERNEL'
 
-            with m.State('FILTER'):
-                m.d.comb += krp.addr.eq(addr)
+            with m.State('COMPRESS'):
+                m.d.comb += self.sink.ready.eq(1)
+                with m.If(self.sink.valid):
+                    sync += [
+                        packing .eq(self.sink.data),
+                        cntr    .eq(0),
+                    ]
+                    m.next = 'KERNEL'
 
-                with m.If(~self.source.valid | self.source.ready):
+                with m.Else():
+                    sync += cntr.eq(cntr + 1)
+
+                check_timeout()
+
+            # The first output is due once halfk rows and columns past it came in
+            with m.State('START'):
+                sync += [
+                    h   .eq(size[:16]),
+                    w   .eq(size[16:]),
+                    lead.eq(halfk * size[16:] + halfk),
+                ]
+                m.next = 'STREAM'
+
+            # A new pixel enters the window on every cycle the window is free,
+            # from the sink or, past the last row, as a placeholder, so a fully
+            # parallel filter takes one pixel per clock.
+            with m.State('STREAM'):
+                m.d.comb += self.unpack.eq((packing & self.PACK_PIXELS) != 0)
+
+                with m.If(advance & ~virtual):
+                    m.d.comb += self.sink.ready.eq(1)
+
+                with m.If(advance & (virtual | self.sink.valid)):
+                    m.d.comb += shift.eq(1)
                     sync += cntr.eq(0)
-                    with m.If(
-                        (row < halfk) | 
-                        (row >= h - halfk) |
-                        (col < halfk) | 
-                        (col >= w - halfk)
-                    ):
-                        sync += addr.eq(0), krow.eq(0), kcol.eq(0)
-                        m.d.comb += krp.addr.eq(0)
-                        iter_filter()
+                    for i in range(self.kernel_size):
+                        for j in range(self.kernel_size):
+                            nxt = win[i * self.kernel_size + j + 1] if j < self.kernel_size - 1 else column[i]
+                            sync += win[i * self.kernel_size + j].eq(nxt)
 
-                    with m.Else():
-                        sync += curr.eq(madd)
-
-                        with m.If(addr >= self.kernel_size**2 - 1):
-                            sync += [
-                                addr                .eq(0),
-                                curr                .eq(0),
-                                kcol                .eq(0),
-                                krow                .eq(0),
-                                self.source.valid   .eq(1),
-                                self.source.data    .eq(madd),
-                            ]
-                            m.d.comb += [
-                                krp.addr            .eq(0),
-                            ]
-                            iter_filter()
+                    iter_colrow(col, row, w)
+
+                    with m.If(lead != 0):
+                        sync += lead.eq(lead - 1)
 
+                    with m.Else():
+                        with m.If((orow == h - 1) & (ocol == w - 1)):
+                            m.next = 'FLUSH'
                         with m.Else():
-                            sync += addr.eq(addr + 1)
-                            m.d.comb += krp.addr.eq(addr + 1)
-                            iter_colrow(kcol, krow, self.kernel_size)
+                            iter_colrow(ocol, orow, w)
+
+                with m.Elif(done):
+                    sync += cntr.eq(0)
 
-                            with m.If(kcol >= self.kernel_size - 1):
-                                m.d.comb += mrp.addr.eq((watchrow + 1) * w + col - halfk)
-                            with m.Else():
-                                m.d.comb += mrp.addr.eq(watchrow * w + watchol)
+                with m.Else():
+                    sync += cntr.eq(cntr + 1)
+                    check_timeout()
+
+            with m.State('FLUSH'):
+                with m.If(~valid[0] & ~valid[1] & advance):
+                    m.next = 'KERNEL'
 
                 with m.Else():
                     sync += cntr.eq(cntr + 1)
+                    check_timeout()
 
-                check_timeout()
+        with m.If(fsm.ongoing('KERNEL')):
+            sync += [busy.eq(0), load.eq(0), *[v.eq(0) for v in valid]]
+
+        # Resync drops the frame in progress and drains the sink while held. The
+        # frames that follow are not packed until asked for again.
+        with m.If(self.resync):
+            m.d.comb += self.sink.ready.eq(1)
+            sync += [
+                fsm.state           .eq(fsm.encoding['KERNEL']),
+                self.source.valid   .eq(0),
+                busy                .eq(0),
+                load                .eq(0),
+                *[v.eq(0) for v in valid],
+                cntr                .eq(0),
+                packing             .eq(0),
+            ]
 
         return m
@@ -4,8 +4,9 @@ from dsp_fpga.platform.platform import DE0NanoPlatform
 import argparse
 from dsp_fpga.tp_final.hdl.fifo import Fifo
 from dsp_fpga.tp_final.hdl.uart import Uart
-from dsp_fpga.tp_final.hdl.adapter import Adapter
+from dsp_fpga.tp_final.hdl.compression import Compressor, Decompressor
 from dsp_fpga.tp_final.hdl.kernel_filter import KernelFilter
+from dsp_fpga.tp_final.protocol import BASE_BAUDRATE
 from math import ceil, log2
 
 if __name__ == '__main__':
@@ -15,6 +16,9 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--no-program', required = False, action = 'store_true', default = False)
     parser.add_argument('--nvm', required = False, action = 'store_true', default = False)
+    parser.add_argument('--macs', required = False, type = int, default = 11)
+    # The tools are told of any other rate with --base-baudrate
+    parser.add_argument('--baudrate', required = False, type = int, default = BASE_BAUDRATE)
     args = parser.parse_args()
 
     m = Module()
@@ -41,10 +45,10 @@ if __name__ == '__main__':
     platform.add_clock_constraint(clk, 50e6)
 
     m.submodules.kernel = kernel = KernelFilter(
-        h           = 200,
-        w           = 200,
+        w           = 1024,
         kernel_size = 11,
         timeout     = int(2**ceil(log2(clkfreq * 5))),
+        macs        = args.macs,
         domain      = 'sync'
     )
 
@@ -60,37 +64,70 @@ if __name__ == '__main__':
     )
     m.submodules.uart = uart = Uart(
         pins    = platform.request('uart', 0),
-        div_rst = int(clkfreq / 230400),
+        div_rst = int(clkfreq / args.baudrate),
         domain  = 'sync'
     )
-    m.submodules.adapter = adapter = Adapter(
-        input_w  = len(kernel.source.data),
-        output_w = 8,
-        domain   = 'sync', 
+    m.submodules.decompressor = decompressor = Decompressor(
+        domain  = 'sync',
+    )
+    m.submodules.compressor = compressor = Compressor(
+        width   = len(kernel.source.data),
+        domain  = 'sync',
     )
 
     leds = Cat(platform.request('led', i) for i in range(8))
     with m.If(uart.source.valid & uart.source.ready):
         sync += leds.eq(uart.source.data)
 
+    # The uart starts at the given baudrate and goes back to it on a break. A
+    # BAUD command switches it once its acknowledge has been transmitted.
+    divisor = Signal(32, reset = int(clkfreq / args.baudrate))
+    pending = Signal(32)
+    switch  = Signal()
+    idle    = Signal()
+
+    m.d.comb += idle.eq(
+        ~kernel.source.valid & ~compressor.source.valid & ~tfifo.source.valid & uart.tx_rdy
+    )
+
+    with m.If(uart.rx_break):
+        sync += [
+            divisor.eq(divisor.reset),
+            switch .eq(0),
+        ]
+    with m.Elif(kernel.switch):
+        sync += [
+            pending.eq(kernel.divisor),
+            switch .eq(1),
+        ]
+    with m.Elif(switch & idle):
+        sync += [
+            divisor.eq(pending),
+            switch .eq(0),
+        ]
+
     def connect(sink, source):
         return [
             source[v].eq(sink[v]) for v in sink.fields.keys() if v != 'ready'
         ] + [sink.ready.eq(source.ready)]
 
     m.d.comb += [
-        uart.config.divisor.eq(int(clkfreq / 230400)),
+        uart.config.divisor.eq(divisor),
         uart.config.stop.eq(0),
         uart.config.parity.eq(0),
         uart.config.bits.eq(3),
         uart.config.do_break.eq(0),
 
-        *connect(uart.source,  rfifo.sink),
-        *connect(rfifo.source, kernel.sink),
+        kernel.resync.eq(uart.rx_break),
+        decompressor.enable.eq(kernel.unpack),
+
+        *connect(uart.source,         rfifo.sink),
+        *connect(rfifo.source,        decompressor.sink),
+        *connect(decompressor.source, kernel.sink),
 
-        *connect(kernel.source,  adapter.sink),
-        *connect(adapter.source, tfifo.sink),
-        *connect(tfifo.source,   uart.sink),
+        *connect(kernel.source,     compressor.sink),
+        *connect(compressor.source, tfifo.sink),
+        *connect(tfifo.source,      uart.sink),
     ]
 
     for name in platform.required_tools + ['quartus_pgm', 'quartus_cpf']:
@@ -244,7 +244,8 @@ class Uart(Elaboratable):
             ('do_break', 1)
         ])
 
-        self.tx_rdy = Signal()
+        self.tx_rdy   = Signal()
+        self.rx_break = Signal()
 
     def elaborate(self, platform):
         m = Module()
@@ -254,9 +255,23 @@ class Uart(Elaboratable):
             AsyncSerial(pins=self.pins, div_rst = self.div_rst)
         )
 
+        # A break frame raises rx_break, which is held until the line has been
+        # idle for longer than a frame, dropping the tail of the break
+        idle = Signal(len(self.config.divisor) + 4)
+        with m.If(uart.rx.i):
+            with m.If(idle >= (self.config.divisor << 3) + (self.config.divisor << 2)):
+                sync += self.rx_break.eq(0)
+            with m.Else():
+                sync += idle.eq(idle + 1)
+        with m.Else():
+            sync += idle.eq(0)
+
+        with m.If(uart.rx.rdy & uart.rx.err.break_cond):
+            sync += self.rx_break.eq(1)
+
         with m.If(self.source.valid & self.source.ready):
             sync += self.source.valid.eq(0)
-        with m.If(uart.rx.rdy):
+        with m.If(uart.rx.rdy & ~uart.rx.err.break_cond & ~self.rx_break):
             sync += [
                 self.source.data.eq(uart.rx.data),
                 self.source.valid.eq(1),
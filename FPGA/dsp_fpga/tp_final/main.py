@@ -1,10 +1,23 @@
 import os
 import sys
+import argparse
 from PyQt5.QtWidgets import QApplication
 from dsp_fpga.tp_final.gui import Gui
+from dsp_fpga.tp_final.protocol import PACK_PIXELS, PACK_RESPONSES, BASE_BAUDRATE
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = Gui('/dev/ttyUSB0', 230400, 10)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', required = False, default = '/dev/ttyUSB0')
+    parser.add_argument('--baudrate', required = False, type = int, default = 2000000)
+    parser.add_argument('--base-baudrate', required = False, type = int, default = BASE_BAUDRATE)
+    parser.add_argument('--pack', required = False, action = 'store_true', default = False)
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = Gui(
+        args.port, args.baudrate, 10,
+        packing       = PACK_PIXELS | PACK_RESPONSES if args.pack else 0,
+        base_baudrate = args.base_baudrate,
+    )
     window.show()
     sys.exit(app.exec())
@@ -0,0 +1,159 @@
+from dsp_fpga.tp_final.protocol import (
+    encode_kernel, encode_shape, encode_pixels, encode_packed_pixels, iter_rows, iter_packed_rows,
+    RESPONSE_BYTES, BORDER_ZERO, PACK_PIXELS, PACK_RESPONSES, OUTPUT_WRAP24, OUTPUTS,
+)
+
+import numpy as np
+
+from threading import Thread, Condition
+
+class Pipeline:
+
+    # Must match hdl/top.py: the rfifo holds what KernelFilter has not
+    # consumed yet, the tfifo what it has produced but not transmitted yet,
+    # and the kernel size sets how far ahead of its output it reads.
+    RX_FIFO_DEPTH = 256
+    TX_FIFO_DEPTH = 256
+    KERNEL_SIZE   = 11
+
+    def __init__(self, uart, kernel_size = KERNEL_SIZE, window = RX_FIFO_DEPTH, chunk = 4096, width = RESPONSE_BYTES, packing = 0):
+        self.uart        = uart
+        self.packing     = packing
+        self.kernel_size = kernel_size
+        self.window      = window
+        self.chunk       = chunk
+        self.width       = width
+        self.cond        = Condition()
+
+    def run(self, img, kernel, progress = None, out = None, reuse = False, border = BORDER_ZERO, shift = 0, output = OUTPUT_WRAP24):
+        if len(img.shape) == 2:
+            img = img.reshape(*img.shape, 1)
+
+        h, w, nch = img.shape
+
+        shape   = encode_shape(img.shape)
+        headers = [encode_kernel(None if reuse or dim else kernel, border, shift, output) + shape for dim in range(nch)]
+        res     = np.zeros(img.shape, dtype = np.int32) if out is None else out
+
+        if self.packing & PACK_PIXELS:
+            pixels, self.ends = zip(*(encode_packed_pixels(img[:, :, dim]) for dim in range(nch)))
+        else:
+            pixels, self.ends = [encode_pixels(img[:, :, dim]) for dim in range(nch)], None
+
+        frames = [header + data for header, data in zip(headers, pixels)]
+
+        # Unpacked responses take the bytes of the output format, packed ones
+        # up to a group of 7 bits for every 7 bits of the full width
+        nbytes, signed = OUTPUTS[output]
+        if self.packing & PACK_RESPONSES:
+            self.backlog = self.TX_FIFO_DEPTH // -(-8 * self.width // 7)
+        else:
+            self.backlog = self.TX_FIFO_DEPTH // nbytes
+
+        self.shape    = (h, w)
+        self.headers  = [len(header) for header in headers]
+        self.offsets  = np.cumsum([0] + [len(frame) for frame in frames]).tolist()
+        self.received = 0
+        self.pixels   = 0
+        self.alive    = True
+        self.failed   = False
+
+        sender = Thread(target = self.send_frames, args = (frames,))
+        sender.start()
+
+        total = img.size * nbytes
+        done  = 0
+
+        # Packed responses take as many bytes as they need, so the stream is
+        # read until all rows of every frame came in
+        try:
+            if self.packing & PACK_RESPONSES:
+                stream = iter_packed_rows(self.uart.receive_stream(None), w, h, self.width)
+            else:
+                stream = iter_rows(self.uart.receive_stream(img.size * nbytes), w, nbytes, signed)
+
+            for row, rows in stream:
+                while len(rows):
+                    dim, row = divmod(row, h)
+                    n = min(len(rows), h - row)
+
+                    res[row : row + n, :, dim] = rows[:n]
+                    done += n * w * nbytes
+                    if progress is not None:
+                        progress(done, total)
+
+                    with self.cond:
+                        self.received = dim + (row + n == h)
+                        self.pixels   = (row + n) * w % (h * w)
+                        self.cond.notify()
+
+                    row   = dim * h + row + n
+                    rows  = rows[n:]
+
+                if done == total:
+                    break
+
+            if done != total:
+                res = None
+
+        finally:
+            with self.cond:
+                self.alive = False
+                self.cond.notify()
+            sender.join()
+
+        if self.failed:
+            raise IOError("Failed to connect with serial device")
+
+        return res
+
+    def consumed(self, n):
+        # Pixels KernelFilter must have read before producing its first n
+        # outputs: each output is emitted once the pixel k//2 rows and k//2
+        # columns past it in the stream is in.
+        h, w  = self.shape
+        halfk = self.kernel_size // 2
+
+        return min(n + halfk * w + halfk, h * w)
+
+    def position(self, frame, n):
+        # Bytes of the pixels of a frame KernelFilter reads to take n of them
+        if self.ends is None or not n:
+            return n
+
+        return int(self.ends[frame][n - 1])
+
+    def credit(self, frame, sent, size):
+        # KernelFilter only starts on a frame once it has returned to its idle
+        # state, which the host observes as the previous frame being fully
+        # received. While receiving a frame it keeps reading as long as the
+        # tfifo has room for its outputs, so it will have consumed at least
+        # enough pixels for the ones received plus what the tfifo holds.
+        # Anything sent beyond that, including the start of the next frames,
+        # has to fit in the rfifo.
+        done = self.offsets[self.received]
+        if self.received < len(self.headers):
+            done += self.headers[self.received] + self.position(self.received, self.consumed(self.pixels + self.backlog))
+
+        return min(size, done + self.window - self.offsets[frame]) - sent
+
+    def send_frames(self, frames):
+        for frame, data in enumerate(frames):
+            data = memoryview(data)
+            sent = 0
+
+            while sent < len(data):
+                with self.cond:
+                    while self.alive and self.credit(frame, sent, len(data)) <= 0:
+                        self.cond.wait()
+
+                    if not self.alive:
+                        return
+
+                    n = min(self.credit(frame, sent, len(data)), self.chunk)
+
+                if self.uart.send_buffer(data[sent : sent + n]) != 0:
+                    self.failed = True
+                    return
+
+                sent += n
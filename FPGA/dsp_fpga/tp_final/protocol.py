@@ -0,0 +1,290 @@
+import numpy as np
+
+SIZE_BYTES     = 1
+COEF_BYTES     = 2
+SHAPE_BYTES    = 2
+PIXEL_BYTES    = 1
+RESPONSE_BYTES = 3
+
+# Ports starting with it are served by the emulator, see emulator.py
+EMULATOR_URL   = 'emulator://'
+# Rate the uart of the FPGA starts at, and goes back to after every break,
+# unless hdl/top.py was built for another one
+BASE_BAUDRATE  = 230400
+
+# Sent instead of the kernel size to filter with the last uploaded kernel
+REUSE_KERNEL   = 0xFF
+# Sent instead of the kernel size to switch the uart to a new divisor, which
+# the FPGA echoes back as a response before switching
+BAUD           = 0xFE
+# Sent instead of the kernel size, followed by the PACK flags for the frames to
+# come. Packed pixels go as their differences in packets of up to PACKET
+# bytes: a header with RUN set is followed by one difference applied count
+# times, and otherwise by count differences, count - 1 being the rest of the
+# header. Packed responses go as zigzag encoded differences in groups of 7
+# bits, with bit 7 set on all but the last.
+COMPRESS       = 0xFD
+PACK_PIXELS    = 0x1
+PACK_RESPONSES = 0x2
+PACKET         = 0x80
+RUN            = 0x80
+# Set in the kernel size when the kernel is sent as a column and a row
+SEPARABLE      = 0x80
+
+# How the pixels beyond the image borders are taken, in bits 5 and 6 of the
+# kernel size
+BORDER_ZERO      = 0
+BORDER_REPLICATE = 1
+BORDER_MIRROR    = 2
+BORDER_SHIFT     = 5
+
+# Sent after the kernel size: the responses are shifted right, rounding, by
+# bits 0 to 4, and sent in the OUTPUT format in bits 5 and 6, saturating
+# unless wrapping around in 24 bits
+SCALE_BYTES   = 1
+OUTPUT_WRAP24 = 0
+OUTPUT_SAT16  = 1
+OUTPUT_SAT8   = 2
+OUTPUT_UINT8  = 3
+OUTPUT_SHIFT  = 5
+MAX_SHIFT     = 24
+
+# Bytes and signedness of the responses in every OUTPUT format
+OUTPUTS = {
+    OUTPUT_WRAP24 : (3, True),
+    OUTPUT_SAT16  : (2, True),
+    OUTPUT_SAT8   : (1, True),
+    OUTPUT_UINT8  : (1, False),
+}
+
+def separate(kernel):
+    kernel = np.asarray(kernel, dtype = np.int64)
+    if kernel.ndim != 2 or kernel.shape[0] != kernel.shape[1] or np.linalg.matrix_rank(kernel) != 1:
+        return None
+
+    # The hardware works with integers, so the factors have to be exact
+    i, j = np.unravel_index(np.abs(kernel).argmax(), kernel.shape)
+    row  = kernel[i] // np.gcd.reduce(kernel[i])
+    col  = kernel[:, j] // row[j]
+
+    if (np.outer(col, row) != kernel).any():
+        return None
+
+    return col, row
+
+def output_range(output):
+    nbytes, signed = OUTPUTS[output]
+    if signed:
+        return -(1 << (8 * nbytes - 1)), (1 << (8 * nbytes - 1)) - 1
+
+    return 0, (1 << (8 * nbytes)) - 1
+
+def fit_shift(kernel, output, depth = 8):
+    # Smallest shift that keeps the responses to any pixels of depth bits
+    # within the range of output
+    if isinstance(kernel, tuple):
+        kernel = np.outer(*kernel)
+
+    kernel = np.asarray(kernel, dtype = np.int64)
+    peak   = (1 << depth) - 1
+    lo, hi = output_range(output)
+    low    = peak * kernel[kernel < 0].sum()
+    high   = peak * kernel[kernel > 0].sum()
+
+    shift = 0
+    while shift < MAX_SHIFT - 1 and (
+        (high + (1 << shift >> 1)) >> shift > hi or
+        (lo < 0 and (low + (1 << shift >> 1)) >> shift < lo)
+    ):
+        shift += 1
+
+    return shift
+
+def scale_responses(values, shift = 0, output = OUTPUT_WRAP24):
+    # What KernelFilter makes of its 24-bit responses
+    values = ((np.asarray(values, dtype = np.int64) + (1 << 23)) & 0xFFFFFF) - (1 << 23)
+    values = (values + (1 << shift >> 1)) >> shift
+
+    if output == OUTPUT_WRAP24:
+        return ((values + (1 << 23)) & 0xFFFFFF) - (1 << 23)
+
+    return np.clip(values, *output_range(output))
+
+def remap(idx, n, border):
+    # Index of the pixel standing in for each of idx in a line of n pixels,
+    # and whether it counts at all, as KernelFilter takes them
+    if border == BORDER_MIRROR:
+        idx = np.where(idx < 0, -idx, np.where(idx >= n, 2*n - 2 - idx, idx))
+
+    valid = (idx >= 0) & (idx < n) if border == BORDER_ZERO else np.ones(len(idx), dtype = bool)
+    return np.clip(idx, 0, n - 1), valid
+
+def encode_kernel(kernel, border = BORDER_ZERO, shift = 0, output = OUTPUT_WRAP24):
+    if kernel is None:
+        return bytes([REUSE_KERNEL])
+
+    if border not in (BORDER_ZERO, BORDER_REPLICATE, BORDER_MIRROR):
+        raise ValueError("Invalid border mode: {} is not allowed".format(border))
+
+    if output not in OUTPUTS or not 0 <= shift < MAX_SHIFT:
+        raise ValueError("Invalid output scaling: {} and {} is not allowed".format(shift, output))
+
+    mode  = border << BORDER_SHIFT
+    scale = bytes([shift | (output << OUTPUT_SHIFT)])
+
+    # KernelFilter takes odd sizes only, an even one would be filtered as
+    # the next odd size
+    shape = tuple(np.size(v) for v in kernel) if isinstance(kernel, tuple) else np.shape(kernel)
+    if len(shape) != 2 or shape[0] != shape[1] or not shape[0] % 2 or not 0 < shape[0] < 0x20:
+        raise ValueError("Invalid kernel size: {} is not allowed".format(shape))
+
+    if isinstance(kernel, tuple):
+        col, row = (np.asarray(v).reshape(-1) for v in kernel)
+        return b''.join((
+            bytes([(len(col) & 0x1F) | mode | SEPARABLE]),
+            scale,
+            np.concatenate((col, row)).astype(np.int64).astype('<u2').tobytes(),
+        ))
+
+    kernel = np.asarray(kernel)
+    return b''.join((
+        bytes([(kernel.shape[0] & 0x1F) | mode]),
+        scale,
+        kernel.reshape(-1).astype(np.int64).astype('<u2').tobytes(),
+    ))
+
+def encode_baud(divisor):
+    return bytes([BAUD]) + np.uint32(divisor).astype('<u4').tobytes()
+
+def encode_compress(flags):
+    return bytes([COMPRESS, flags])
+
+def encode_packed_pixels(img, min_run = 3):
+    # Also returns, for each pixel, the bytes KernelFilter must have read
+    # before taking it
+    diff = np.diff(np.ascontiguousarray(img, dtype = np.uint8).reshape(-1), prepend = np.uint8(0))
+    n    = len(diff)
+    if not n:
+        return b'', np.zeros(0, dtype = np.int64)
+
+    # Runs of equal differences long enough are repeated, what lies between
+    # them goes as literals, and both are cut in packets
+    starts  = np.flatnonzero(np.diff(diff, prepend = diff[0] ^ 1))
+    lengths = np.diff(np.append(starts, n))
+    runs    = lengths >= min_run
+
+    cuts    = np.flatnonzero(runs | np.roll(runs, 1) | (np.arange(len(starts)) == 0))
+    seg     = starts[cuts]
+    seglen  = np.diff(np.append(seg, n))
+    segrun  = runs[cuts]
+
+    npack   = -(-seglen // PACKET)
+    first   = np.repeat(seg, npack) + PACKET * (np.arange(npack.sum()) - np.repeat(np.cumsum(npack) - npack, npack))
+    count   = np.minimum(np.repeat(seg + seglen, npack) - first, PACKET)
+    run     = np.repeat(segrun, npack)
+
+    size    = np.where(run, 2, count + 1)
+    offset  = np.cumsum(size) - size
+    data    = np.zeros(size.sum(), dtype = np.uint8)
+
+    data[offset] = (count - 1) | np.where(run, RUN, 0)
+    data[offset[run] + 1] = diff[first[run]]
+
+    packet  = np.repeat(np.arange(len(first)), count)
+    index   = np.arange(n) - first[packet]
+    literal = ~run[packet]
+    data[offset[packet[literal]] + 1 + index[literal]] = diff[literal]
+
+    ends    = np.where(run[packet], offset[packet] + 2, offset[packet] + 2 + index)
+    return data.tobytes(), ends
+
+def encode_shape(shape):
+    return np.asarray(shape[:2], dtype = np.int64).astype('<u2').tobytes()
+
+def encode_pixels(img):
+    return np.ascontiguousarray(img, dtype = np.uint8).tobytes()
+
+def encode_frame(kernel, img, border = BORDER_ZERO, shift = 0, output = OUTPUT_WRAP24):
+    return b''.join((
+        encode_kernel(kernel, border, shift, output),
+        encode_shape(img.shape),
+        encode_pixels(img),
+    ))
+
+def decode_response(data, width = RESPONSE_BYTES, signed = True):
+    if width < 1 or width > 4:
+        raise ValueError("Invalid response width: {} bytes is not allowed".format(width))
+
+    raw = np.frombuffer(data, dtype = np.uint8)
+    raw = raw[: len(raw) - len(raw) % width].reshape(-1, width)
+
+    words = np.zeros((len(raw), 4), dtype = np.uint8)
+    words[:, 4 - width :] = raw
+
+    shift = np.int32(32 - (width << 3))
+    if not signed:
+        return (words.view('<u4').reshape(-1) >> np.uint32(shift)).astype(np.int32)
+
+    return words.view('<i4').reshape(-1) >> shift
+
+def decode_packed_responses(data, last = 0, width = RESPONSE_BYTES):
+    # Returns the values of the complete groups in data, how many bytes they
+    # take and the last value, to carry on with the bytes left
+    raw  = np.frombuffer(data, dtype = np.uint8)
+    ends = np.flatnonzero(raw < 0x80)
+    if not len(ends):
+        return np.zeros(0, dtype = np.int32), 0, last
+
+    used   = ends[-1] + 1
+    starts = np.append(0, ends[:-1] + 1)
+    groups = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = 7 * (np.arange(used) - starts[groups])
+
+    zigzag = np.add.reduceat((raw[:used] & 0x7F).astype(np.int64) << shifts, starts)
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+
+    half   = 1 << (8 * width - 1)
+    values = ((last + np.cumsum(deltas) + half) & ((half << 1) - 1)) - half
+    return values.astype(np.int32), used, int(values[-1])
+
+def iter_rows(chunks, w, width = RESPONSE_BYTES, signed = True):
+    row_bytes = w * width
+    pending   = bytearray()
+    row       = 0
+
+    for chunk in chunks:
+        pending += chunk
+        n = len(pending) // row_bytes
+        if n:
+            yield row, decode_response(pending[: n * row_bytes], width, signed).reshape(n, w)
+            del pending[: n * row_bytes]
+            row += n
+
+def iter_packed_rows(chunks, w, h, width = RESPONSE_BYTES):
+    # Rows of consecutive frames of h rows, whose differences each start over
+    pending = bytearray()
+    values  = np.zeros(0, dtype = np.int32)
+    last    = 0
+    row     = 0
+
+    for chunk in chunks:
+        pending += chunk
+        while True:
+            # Values are decoded no further than the end of the current frame
+            left = (h - row % h) * w - len(values)
+            ends = np.flatnonzero(np.frombuffer(pending, dtype = np.uint8) < 0x80)[:left]
+            if not len(ends):
+                break
+
+            new, used, last = decode_packed_responses(pending[: ends[-1] + 1], last, width)
+            del pending[:used]
+
+            values = np.append(values, new)
+            if len(new) == left:
+                last = 0
+
+            n = len(values) // w
+            if n:
+                yield row, values[: n * w].reshape(n, w)
+                values = values[n * w :]
+                row   += n
@@ -0,0 +1,172 @@
+from dsp_fpga.tp_final.uart import Uart
+from dsp_fpga.tp_final.pipeline import Pipeline
+from dsp_fpga.tp_final.protocol import (
+    encode_kernel, encode_baud, encode_compress, RESPONSE_BYTES, SIZE_BYTES, BORDER_ZERO, OUTPUT_WRAP24, BASE_BAUDRATE,
+)
+
+import numpy as np
+
+from hashlib import sha1
+from time import sleep
+
+class Session:
+
+    # Bytes the FPGA may still be transmitting after a resync: the tfifo in
+    # hdl/top.py plus one word held by the compressor, packed or not.
+    TX_FIFO_DEPTH = 256 + RESPONSE_BYTES + 1
+    BREAK_TIME    = .25
+    RETRIES       = 1
+
+    # The FPGA runs at base_baudrate after configuration and after every
+    # break, and any other rate is a divisor of its clock, see hdl/top.py
+    CLOCK_FREQ     = int(50e6)
+    BAUDRATE_ERROR = .02
+
+    # Must match hdl/top.py
+    KERNEL_SIZE    = 11
+    MAX_IMG_WIDTH  = 1024
+    MAX_IMG_HEIGHT = 2**16 - 1
+
+    def __init__(self, port, baudrate, timeout, width = RESPONSE_BYTES, packing = 0, base_baudrate = BASE_BAUDRATE):
+        self.port     = port
+        self.baudrate = baudrate
+        self.base_baudrate = base_baudrate
+        self.timeout  = timeout
+        self.width    = width
+        self.packing  = packing
+        self.uart     = None
+        self.kernel   = None
+
+        self.connect()
+
+    def connect(self):
+        try:
+            if self.uart is None:
+                self.uart = Uart(self.port, self.base_baudrate, self.timeout)
+            else:
+                self.uart.reopen()
+
+        except Exception as e:
+            print(e)
+
+        if not self.healthy():
+            print("Hardware error: Failed to open serial port")
+            return False
+
+        return self.resync()
+
+    def resync(self):
+        # A break condition on the line sends KernelFilter back to its idle
+        # state and drops whatever is left in the rfifo. Whatever the FPGA was
+        # still transmitting is discarded once it had time to arrive. The
+        # kernel memory may have been half written, so it is uploaded again.
+        # The break also takes the uart back to base_baudrate and unpacked
+        # frames, so the faster rate is negotiated again, or given up on if
+        # that fails, and packing asked for again.
+        self.kernel = None
+
+        if self.uart.set_baudrate(self.base_baudrate) != 0:
+            return False
+
+        if self.uart.send_break(self.BREAK_TIME) != 0:
+            return False
+
+        sleep(self.TX_FIFO_DEPTH * 10 / self.base_baudrate)
+        if self.uart.flush() != 0:
+            return False
+
+        if self.baudrate != self.base_baudrate and not self.negotiate(self.baudrate):
+            self.fallback()
+            return self.resync()
+
+        return not self.packing or self.uart.send(encode_compress(self.packing)) == 0
+
+    def negotiate(self, baudrate):
+        divisor = round(self.CLOCK_FREQ / baudrate)
+        if divisor < 2 or abs(self.CLOCK_FREQ / divisor / baudrate - 1) > self.BAUDRATE_ERROR:
+            print("Unsupported baudrate: {}".format(baudrate))
+            return False
+
+        # The FPGA acknowledges at the current rate and then switches. The
+        # same command sent again at the new rate checks both ends agree. The
+        # acknowledge always takes RESPONSE_BYTES, whatever the width.
+        command = encode_baud(divisor)
+        ack     = command[SIZE_BYTES : SIZE_BYTES + RESPONSE_BYTES]
+
+        if self.uart.send(command) != 0 or self.uart.receive(RESPONSE_BYTES) != ack:
+            return False
+
+        if self.uart.set_baudrate(baudrate) != 0:
+            return False
+
+        return self.uart.send(command) == 0 and self.uart.receive(RESPONSE_BYTES) == ack
+
+    def fallback(self):
+        if self.baudrate != self.base_baudrate:
+            print("Falling back to {} baud".format(self.base_baudrate))
+            self.baudrate = self.base_baudrate
+
+    def healthy(self):
+        return self.uart is not None and self.uart.is_alive()
+
+    def fits(self, img, kernel):
+        if img.shape[0] > self.MAX_IMG_HEIGHT or img.shape[1] > self.MAX_IMG_WIDTH:
+            print("Image is too big for hardware implementation")
+            return False
+
+        if isinstance(kernel, tuple):
+            shape = tuple(np.size(v) for v in kernel)
+        else:
+            shape = np.shape(kernel)
+
+        if (
+            len(shape) != 2 or
+            shape[0] != shape[1] or
+            shape[0] % 2 == 0 or
+            shape[0] > self.KERNEL_SIZE
+        ):
+            print("Wrong kernel format")
+            return False
+
+        return True
+
+    def run(self, img, kernel, progress = None, out = None, border = BORDER_ZERO, shift = 0, output = OUTPUT_WRAP24):
+        if not self.fits(img, kernel):
+            return None
+
+        for _ in range(self.RETRIES + 1):
+            if not self.healthy() and not self.connect():
+                continue
+
+            digest      = sha1(encode_kernel(kernel, border, shift, output)).digest()
+            reuse       = digest == self.kernel
+            self.kernel = None
+
+            try:
+                res = Pipeline(self.uart, width = self.width, packing = self.packing).run(
+                    img, kernel, progress, out, reuse, border, shift, output,
+                )
+            except IOError:
+                print("Serial port disconnected")
+                self.uart.close()
+                continue
+
+            # Errors at a negotiated rate are taken as a sign the line cannot
+            # keep up with it, and the frame is sent again at BAUDRATE
+            if res is None and self.baudrate != self.base_baudrate:
+                self.fallback()
+                self.resync()
+                continue
+
+            if res is None:
+                self.resync()
+            else:
+                self.kernel = digest
+
+            return res
+
+        return None
+
+    def close(self):
+        if self.uart is not None:
+            self.uart.close()
@@ -0,0 +1,23 @@
+from dsp_fpga.tp_final.hdl.bench import Bench, reference
+from dsp_fpga.tp_final.protocol import encode_frame, BORDER_ZERO, BORDER_REPLICATE, BORDER_MIRROR
+
+import numpy as np
+import pytest
+
+# A small filter on small frames, for the simulation to stay quick
+@pytest.mark.parametrize('border, macs, separable', [
+    (BORDER_ZERO,      9, False),
+    (BORDER_REPLICATE, 2, False),
+    (BORDER_MIRROR,    3, True),
+])
+def test_kernel_filter(border, macs, separable):
+    rng = np.random.default_rng(border)
+    img = rng.integers(0, 256, (6, 5), dtype = np.uint8)
+    col = rng.integers(-128, 128, 3)
+    row = rng.integers(-128, 128, 3)
+
+    kernel = np.outer(col, row) if separable else rng.integers(-128, 128, (3, 3))
+    ref    = reference(img, kernel, border).reshape(-1)
+
+    res, stats = Bench(5, 3, macs = macs).run(encode_frame((col, row) if separable else kernel, img, border), ref.size)
+    assert len(res) == len(ref) and (res == ref).all()
@@ -0,0 +1,56 @@
+from dsp_fpga.tp_final.core.kernels import convolve
+from dsp_fpga.tp_final.emulator import convolve as emulate
+from dsp_fpga.tp_final.protocol import (
+    scale_responses, BORDER_ZERO, BORDER_REPLICATE, BORDER_MIRROR, OUTPUT_WRAP24, OUTPUT_SAT16, OUTPUT_SAT8, OUTPUT_UINT8,
+)
+
+import numpy as np
+import pytest
+
+BORDERS = [BORDER_ZERO, BORDER_REPLICATE, BORDER_MIRROR]
+OUTPUTS = [(0, OUTPUT_WRAP24), (3, OUTPUT_SAT16), (6, OUTPUT_SAT8), (8, OUTPUT_UINT8)]
+
+def expected(img, kernel, border, shift, output):
+    # The emulator works out the responses of KernelFilter row by row
+    h, w = img.shape
+    res  = np.stack([emulate(img, kernel, row, 0, w, border) for row in range(h)])
+    return scale_responses(res, shift, output)
+
+@pytest.mark.parametrize('border', BORDERS)
+@pytest.mark.parametrize('shift, output', OUTPUTS)
+@pytest.mark.parametrize('k', [1, 3, 5])
+def test_convolve_matches_emulator(border, shift, output, k):
+    rng    = np.random.default_rng(k)
+    img    = rng.integers(0, 256, (7, 9), dtype = np.uint8)
+    kernel = rng.integers(-2**15, 2**15, (k, k))
+
+    res = convolve(img, kernel, border, shift, output)
+    assert res.dtype == np.int64
+    assert (res == expected(img, kernel, border, shift, output)).all()
+
+@pytest.mark.parametrize('border', BORDERS)
+def test_convolve_separable_matches_emulator(border):
+    rng = np.random.default_rng(border)
+    img = rng.integers(0, 256, (8, 6), dtype = np.uint8)
+    col = rng.integers(-128, 128, 5)
+    row = rng.integers(-128, 128, 5)
+
+    res = convolve(img, (col, row), border)
+    assert (res == expected(img, np.outer(col, row), border, 0, OUTPUT_WRAP24)).all()
+
+def test_convolve_channels():
+    rng    = np.random.default_rng(0)
+    img    = rng.integers(0, 256, (6, 5, 3), dtype = np.uint8)
+    kernel = rng.integers(-128, 128, (3, 3))
+
+    res = convolve(img, kernel, BORDER_MIRROR)
+    for c in range(3):
+        assert (res[..., c] == expected(img[..., c], kernel, BORDER_MIRROR, 0, OUTPUT_WRAP24)).all()
+
+def test_convolve_wraps_in_24_bits():
+    # Responses well past 24 bits wrap around as on the FPGA
+    img    = np.full((64, 64), 255, dtype = np.uint8)
+    kernel = np.full((11, 11), 2**15 - 1)
+
+    res = convolve(img, kernel)
+    assert (res == expected(img, kernel, BORDER_ZERO, 0, OUTPUT_WRAP24)).all()
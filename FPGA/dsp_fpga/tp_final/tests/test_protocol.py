@@ -0,0 +1,150 @@
+from dsp_fpga.tp_final.emulator import Emulator
+from dsp_fpga.tp_final.protocol import (
+    encode_kernel, encode_shape, encode_frame, encode_baud, encode_compress, encode_packed_pixels, decode_response,
+    iter_rows, iter_packed_rows, scale_responses, separate, fit_shift, output_range,
+    BORDER_ZERO, BORDER_REPLICATE, BORDER_MIRROR, PACK_PIXELS, PACK_RESPONSES, SIZE_BYTES, RESPONSE_BYTES,
+    OUTPUT_WRAP24, OUTPUT_SAT16, OUTPUT_SAT8, OUTPUT_UINT8, OUTPUTS,
+)
+from dsp_fpga.tp_final.hdl.bench import reference
+
+import numpy as np
+import pytest
+
+def exchange(emulator, data, chunk = 64):
+    # Feeds the emulator no faster than it empties its rfifo, taking whatever
+    # it sends back as it goes
+    out = bytearray()
+    for i in range(0, len(data) + 1, chunk):
+        emulator.receive(data[i : i + chunk])
+        while emulator.tfifo:
+            out += emulator.tfifo
+            emulator.tfifo.clear()
+            emulator.step()
+
+    assert not emulator.overflows
+    return bytes(out)
+
+def unpack(img, packed):
+    diff = np.frombuffer(packed, dtype = np.uint8)
+    res  = []
+    pos  = 0
+    while pos < len(diff):
+        count = int(diff[pos] & 0x7F) + 1
+        if diff[pos] & 0x80:
+            res.append(np.full(count, diff[pos + 1], dtype = np.uint8))
+            pos += 2
+        else:
+            res.append(diff[pos + 1 : pos + 1 + count])
+            pos += 1 + count
+
+    return (np.cumsum(np.concatenate(res).astype(np.int64)) & 0xFF).reshape(img.shape)
+
+@pytest.mark.parametrize('img', [
+    np.zeros((1, 1), dtype = np.uint8),
+    np.full((3, 200), 7, dtype = np.uint8),
+    np.tile(np.arange(256, dtype = np.uint8), (2, 1)),
+    np.random.default_rng(0).integers(0, 256, (9, 300), dtype = np.uint8),
+    np.random.default_rng(1).integers(0, 4, (5, 70), dtype = np.uint8) * 50,
+])
+def test_packed_pixels_round_trip(img):
+    data, ends = encode_packed_pixels(img)
+    assert (unpack(img, data) == img).all()
+    assert len(ends) == img.size and ends[-1] == len(data) and (np.diff(ends) >= 0).all()
+
+@pytest.mark.parametrize('output', OUTPUTS.keys())
+def test_decode_response(output):
+    width, signed = OUTPUTS[output]
+    lo, hi = output_range(output)
+    values = np.array([lo, lo + 1, -1 if signed else 1, 0, hi - 1, hi])
+
+    data = (values & 0xFFFFFFFF).astype('<u4').view(np.uint8).reshape(-1, 4)[:, : width].tobytes()
+    assert (decode_response(data, width, signed) == values).all()
+
+    # Rows come out whole, however the bytes were cut
+    chunks = [data[i : i + 5] for i in range(0, len(data), 5)]
+    rows   = np.concatenate([rows for _, rows in iter_rows(chunks, 3, width, signed)])
+    assert (rows == values.reshape(2, 3)).all()
+
+def test_decode_response_width():
+    with pytest.raises(ValueError):
+        decode_response(b'\x00' * 5, 5)
+
+@pytest.mark.parametrize('kernel', [
+    np.ones((2, 2)),
+    np.ones((3, 5)),
+    np.ones((33, 33)),
+    np.ones(3),
+    (np.ones(3), np.ones(5)),
+])
+def test_encode_kernel_rejects_sizes(kernel):
+    with pytest.raises(ValueError):
+        encode_kernel(kernel)
+
+def test_encode_kernel_rejects_modes():
+    with pytest.raises(ValueError):
+        encode_kernel(np.ones((3, 3)), border = 3)
+    with pytest.raises(ValueError):
+        encode_kernel(np.ones((3, 3)), shift = 24)
+    with pytest.raises(ValueError):
+        encode_kernel(np.ones((3, 3)), output = 4)
+
+def test_separate():
+    col, row = separate(np.outer([1, 2, 1], [-1, 0, 1]))
+    assert (np.outer(col, row) == np.outer([1, 2, 1], [-1, 0, 1])).all()
+    assert separate(np.eye(3)) is None
+
+@pytest.mark.parametrize('output', [OUTPUT_SAT16, OUTPUT_SAT8, OUTPUT_UINT8])
+def test_fit_shift(output):
+    kernel = np.full((5, 5), 300)
+    lo, hi = output_range(output)
+    shift  = fit_shift(kernel, output)
+
+    res = scale_responses(255 * kernel.sum(), shift)
+    assert lo <= res <= hi
+    assert scale_responses(255 * kernel.sum(), shift - 1) > hi
+
+def test_scale_responses():
+    values = np.array([-(1 << 23) - 1, -300, -1, 0, 1, 2, 3, 300, 1 << 23])
+    assert (scale_responses(values) == [(1 << 23) - 1, -300, -1, 0, 1, 2, 3, 300, -(1 << 23)]).all()
+    assert (scale_responses(values[1:-1], 1) == [-150, 0, 0, 1, 1, 2, 150]).all()
+    assert (scale_responses(values[1:-1], 0, OUTPUT_SAT8) == [-128, -1, 0, 1, 2, 3, 127]).all()
+    assert (scale_responses(values[1:-1], 0, OUTPUT_UINT8) == [0, 0, 0, 1, 2, 3, 255]).all()
+
+def test_baud_acknowledge():
+    # The acknowledge takes RESPONSE_BYTES whatever the output format
+    command = encode_baud(217)
+    assert exchange(Emulator(), command) == command[SIZE_BYTES : SIZE_BYTES + RESPONSE_BYTES]
+
+@pytest.mark.parametrize('border', [BORDER_ZERO, BORDER_REPLICATE, BORDER_MIRROR])
+@pytest.mark.parametrize('output', OUTPUTS.keys())
+def test_frames_round_trip(border, output):
+    rng    = np.random.default_rng(border)
+    kernel = rng.integers(-128, 128, (5, 5))
+    imgs   = rng.integers(0, 256, (2, 13, 17), dtype = np.uint8)
+    shift  = fit_shift(kernel, output)
+    width, signed = OUTPUTS[output]
+
+    emulator = Emulator()
+    data     = exchange(emulator, b''.join(
+        encode_frame(kernel if not i else None, img, border, shift, output) for i, img in enumerate(imgs)
+    ))
+    rows = np.concatenate([rows for _, rows in iter_rows([data], 17, width, signed)])
+    ref  = np.concatenate([reference(img, kernel, border, shift = shift, output = output) for img in imgs])
+    assert (rows == ref).all()
+
+@pytest.mark.parametrize('border', [BORDER_ZERO, BORDER_MIRROR])
+def test_packed_frames_round_trip(border):
+    rng  = np.random.default_rng(border)
+    col  = rng.integers(-128, 128, 3)
+    row  = rng.integers(-128, 128, 3)
+    imgs = rng.integers(0, 8, (2, 11, 40), dtype = np.uint8) * 32
+    imgs[:, :, 10:30] = 100
+
+    emulator = Emulator()
+    data     = exchange(emulator, encode_compress(PACK_PIXELS | PACK_RESPONSES) + b''.join(
+        encode_kernel((col, row) if not i else None, border) + encode_shape(img.shape) + encode_packed_pixels(img)[0]
+        for i, img in enumerate(imgs)
+    ))
+    rows = np.concatenate([rows for _, rows in iter_packed_rows([data[i : i + 7] for i in range(0, len(data), 7)], 40, 11)])
+    ref  = np.concatenate([reference(img, np.outer(col, row), border) for img in imgs])
+    assert (rows == ref).all()
@@ -1,4 +1,5 @@
 import serial
+from dsp_fpga.tp_final.protocol import EMULATOR_URL
 
 class Uart:
 
@@ -26,17 +27,29 @@ class Uart:
 
         return 0
 
+    def send_buffer(self, data, chunk = 16384):
+        data = memoryview(data).cast('B')
+
+        try:
+            for i in range(0, len(data), chunk):
+                self.dev.write(data[i : i + chunk])
+        except:
+            print("Write operation failed")
+            return -1
+
+        return 0
+
     def receive(self, n):
         if not isinstance(n, int):
             raise ValueError("Invalid number of bytes: {} is not allowed".format(type(n)))
 
         if n <= 0:
-            return []
+            return b''
 
         try:
-            res = list(self.dev.read(n))
+            res = self.dev.read(n)
         except:
-            res = []
+            res = b''
 
         if len(res) != n:
             print("Read operation faied")
@@ -44,6 +57,59 @@ class Uart:
 
         return res
 
+    def receive_stream(self, n = None, chunk = 4096):
+        # Without n, bytes are received until the caller stops asking
+        if n is not None and not isinstance(n, int):
+            raise ValueError("Invalid number of bytes: {} is not allowed".format(type(n)))
+
+        while n is None or n > 0:
+            try:
+                res = self.dev.read(min(chunk if n is None else n, chunk, max(1, self.dev.in_waiting)))
+            except:
+                res = b''
+
+            if not res:
+                print("Read operation failed")
+                return
+
+            if n is not None:
+                n -= len(res)
+            yield res
+
+    def set_baudrate(self, baudrate):
+        try:
+            self.dev.baudrate = baudrate
+        except:
+            print("Failed to set baudrate")
+            return -1
+
+        self.baudrate = baudrate
+        return 0
+
+    def send_break(self, duration):
+        try:
+            self.dev.reset_output_buffer()
+            self.dev.send_break(duration)
+        except:
+            print("Break operation failed")
+            return -1
+
+        return 0
+
+    def flush(self):
+        try:
+            self.dev.reset_input_buffer()
+        except:
+            return -1
+
+        return 0
+
+    def is_alive(self):
+        try:
+            return self.dev is not None and self.dev.is_open and self.dev.in_waiting >= 0
+        except:
+            return False
+
     def close(self):
         try:
             if self.dev is not None:
@@ -58,9 +124,19 @@ class Uart:
             self.dev.open()
         else:
             try:
-                self.dev = serial.Serial(self.port, self.baudrate, timeout = self.timeout)
+                if self.port.startswith(EMULATOR_URL):
+                    from dsp_fpga.tp_final.emulator import EmulatedSerial
+
+                    self.dev = EmulatedSerial(self.port, self.baudrate, timeout = self.timeout)
+                else:
+                    self.dev = serial.Serial(self.port, self.baudrate, timeout = self.timeout)
             except:
                 self.dev = None
 
+    def reopen(self):
+        self.close()
+        self.dev = None
+        self.open()
+
     def __del__(self):
         self.close()
\ No newline at end of file